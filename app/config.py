@@ -0,0 +1,94 @@
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+# .env in the project root, next to the app/ package
+ENV_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".env")
+
+
+# Settings the application cannot run without, as (Config field, environment variable)
+_REQUIRED_SETTINGS = (
+    ("api_key", "CURRENCY_API_KEY"),
+    ("db_host", "DB_HOST"),
+    ("db_name", "DB_NAME"),
+    ("db_user", "DB_USER"),
+    ("db_password", "DB_PASSWORD"),
+)
+
+
+class ConfigError(ValueError):
+    """Raised when a setting is missing or malformed."""
+
+
+def _load_env(path: str = ENV_FILE):
+    """
+    Copies KEY=value lines from a .env file into os.environ without overriding variables
+    that are already set. Blank lines, comments and a leading "export " are ignored;
+    values may be quoted, and values may carry a trailing " # comment" after them.
+    """
+    if not os.path.isfile(path):
+        return
+    with open(path, encoding="utf-8") as env_file:
+        for line in env_file:
+            line = line.strip()
+            if not line or line.startswith("#") or "=" not in line:
+                continue
+            key, _, value = line.partition("=")
+            key = key.strip()
+            if key.startswith("export "):
+                key = key[len("export "):].strip()
+            value = value.strip()
+            quote = value[:1]
+            closing = value.find(quote, 1) if quote in ("'", '"') else -1
+            if closing > 0:
+                value = value[1:closing] # Anything after the closing quote is a comment
+            else:
+                value = value.split(" #", 1)[0].rstrip()
+            os.environ.setdefault(key, value)
+
+
+@dataclass(frozen=True)
+class Config:
+    """Application settings, read once from the environment (and the .env file)."""
+    api_key: Optional[str]
+    db_host: Optional[str]
+    db_port: int
+    db_name: Optional[str]
+    db_user: Optional[str]
+    db_password: Optional[str]
+
+    @classmethod
+    def load(cls) -> "Config":
+        """
+        Loads .env into the environment and builds a Config from it.
+        Raises ConfigError if DB_PORT is not a number; missing settings are reported by validate().
+        """
+        _load_env(ENV_FILE)
+        db_port = os.getenv("DB_PORT") or "5432" # Default PostgreSQL port, also for an empty DB_PORT=
+        try:
+            db_port = int(db_port)
+        except ValueError:
+            raise ConfigError(f"DB_PORT must be a port number, got {db_port!r}.") from None
+        return cls(
+            api_key=os.getenv("CURRENCY_API_KEY"),
+            db_host=os.getenv("DB_HOST"),
+            db_port=db_port,
+            db_name=os.getenv("DB_NAME"),
+            db_user=os.getenv("DB_USER"),
+            db_password=os.getenv("DB_PASSWORD"),
+        )
+
+    def validate(self):
+        """
+        Raises ConfigError naming every required setting that is missing.
+        Called once at application startup rather than on import, so tools and tests
+        can import the app modules without a complete environment.
+        """
+        missing = [env_var for field, env_var in _REQUIRED_SETTINGS if not getattr(self, field)]
+        if missing:
+            raise ConfigError(
+                f"Missing required settings: {', '.join(missing)}. Set them in the environment or the .env file."
+            )
+
+
+CFG = Config.load()
@@ -1,16 +1,49 @@
-import os
+import time
 import requests
+import orjson
 import logging
-from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-# Load environment variables from .env file
-load_dotenv()
-
-# Configure basic logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+from .config import CFG
 
 API_BASE_URL = "https://currencyapi.net/api/v1/rates"
-API_KEY = os.getenv("CURRENCY_API_KEY")
+API_KEY = CFG.api_key
+
+# (connect, read) timeouts in seconds
+REQUEST_TIMEOUT = (3.05, 10)
+
+# Transient failures (connection errors, timeouts, rate limiting, 5xx) are retried with
+# exponential backoff instead of waiting for the next scheduled run. urllib3 retries the first
+# failure immediately, then waits backoff_factor * 2**(n-1): 0s, 1s, 2s with a factor of 0.5.
+# raise_on_status=False hands the last response back so raise_for_status reports it.
+# Retry-After is ignored: urllib3 would sleep for whatever a 429 asks, uncapped, which on
+# an exhausted quota could block the scheduler thread for hours.
+_RETRY = Retry(
+    total=3,
+    backoff_factor=0.5,
+    status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods=["GET"],
+    respect_retry_after_header=False,
+    raise_on_status=False
+)
+
+# Shared session so repeated calls reuse the pooled TCP/TLS connection to the API host
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=_RETRY))
+
+# Rates are published once a day, so a successful response is reused for a few hours.
+# Maps base currency -> (time.monotonic() when fetched, response data).
+_CACHE: dict[str, tuple[float, dict]] = {}
+_CACHE_TTL = 6 * 3600
+
+def _stale_or_error(base_currency: str, error: dict) -> dict:
+    """Returns the last cached response marked as stale, or the error if nothing is cached."""
+    hit = _CACHE.get(base_currency)
+    if hit:
+        logging.warning("Serving stale cached rates for base currency: %s", base_currency)
+        return {**hit[1], "stale": True}
+    return error
 
 def fetch_latest_rates(api_key: str, base_currency: str = "USD") -> dict:
     """
@@ -23,11 +56,19 @@ def fetch_latest_rates(api_key: str, base_currency: str = "USD") -> dict:
     Returns:
         dict: A dictionary containing the API response data if successful,
               or an error message dictionary if an error occurs.
+              Responses with rates are cached for _CACHE_TTL seconds per base currency; on a
+              connection error or timeout the last cached response is returned
+              with "stale": True instead of an error.
     """
     if not api_key:
         logging.error("API key is not configured. Please set CURRENCY_API_KEY environment variable.")
         return {"error": "API key not configured"}
 
+    hit = _CACHE.get(base_currency)
+    if hit and time.monotonic() - hit[0] < _CACHE_TTL:
+        logging.info("Using cached rates for base currency: %s", base_currency)
+        return hit[1]
+
     params = {
         "key": api_key,
         "base": base_currency
@@ -35,28 +76,32 @@ def fetch_latest_rates(api_key: str, base_currency: str = "USD") -> dict:
     }
 
     try:
-        response = requests.get(API_BASE_URL, params=params)
+        response = _SESSION.get(API_BASE_URL, params=params, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()  # Raises an HTTPError for bad responses (4XX or 5XX)
-        data = response.json()
-        logging.info(f"Successfully fetched rates for base currency: {base_currency}")
+        data = orjson.loads(response.content)
+        logging.info("Successfully fetched rates for base currency: %s", base_currency)
+        # Only usable responses are cached; a provider-side error payload must not be replayed
+        if isinstance(data, dict) and "error" not in data and isinstance(data.get("rates"), dict):
+            _CACHE[base_currency] = (time.monotonic(), data)
         return data
     except requests.exceptions.HTTPError as http_err:
-        logging.error(f"HTTP error occurred: {http_err} - {response.text}")
+        logging.error("HTTP error occurred: %s - %s", http_err, response.text)
         return {"error": f"HTTP error: {http_err}", "status_code": response.status_code, "details": response.text}
     except requests.exceptions.ConnectionError as conn_err:
-        logging.error(f"Connection error occurred: {conn_err}")
-        return {"error": f"Connection error: {conn_err}"}
+        logging.error("Connection error occurred: %s", conn_err)
+        return _stale_or_error(base_currency, {"error": f"Connection error: {conn_err}"})
     except requests.exceptions.Timeout as timeout_err:
-        logging.error(f"Timeout error occurred: {timeout_err}")
-        return {"error": f"Timeout error: {timeout_err}"}
+        logging.error("Timeout error occurred: %s", timeout_err)
+        return _stale_or_error(base_currency, {"error": f"Timeout error: {timeout_err}"})
     except requests.exceptions.RequestException as req_err:
-        logging.error(f"An unexpected error occurred with the request: {req_err}")
+        logging.error("An unexpected error occurred with the request: %s", req_err)
         return {"error": f"Unexpected request error: {req_err}"}
-    except ValueError as json_err: # Includes JSONDecodeError
-        logging.error(f"Failed to decode JSON response: {json_err}")
+    except ValueError as json_err: # Includes orjson.JSONDecodeError
+        logging.error("Failed to decode JSON response: %s", json_err)
         return {"error": f"JSON decode error: {json_err}"}
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
     # This is for basic testing of the fetcher
     # Ensure your .env file has CURRENCY_API_KEY set
     if not API_KEY:
@@ -1,130 +1,371 @@
-import os
+import io
+import threading
+import weakref
 import psycopg2
+from psycopg2.errors import UndefinedTable
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
 import logging
+from contextlib import contextmanager
 from datetime import date
-from dotenv import load_dotenv
 
-# Load environment variables from .env file
-load_dotenv()
+from .config import CFG
 
-# Configure basic logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+DB_HOST = CFG.db_host
+DB_PORT = CFG.db_port
+DB_NAME = CFG.db_name
+DB_USER = CFG.db_user
+DB_PASSWORD = CFG.db_password
 
-DB_HOST = os.getenv("DB_HOST")
-DB_PORT = os.getenv("DB_PORT", "5432") # Default PostgreSQL port
-DB_NAME = os.getenv("DB_NAME")
-DB_USER = os.getenv("DB_USER")
-DB_PASSWORD = os.getenv("DB_PASSWORD")
+# Process-wide connection pool, created on first use by get_pool()
+POOL_MINCONN = 1
+POOL_MAXCONN = 4
+POOL = None
+_POOL_LOCK = threading.Lock()
+
+# Batches at least this large are loaded with COPY through a staging table;
+# smaller ones are cheaper as a single multi-row INSERT.
+COPY_THRESHOLD = 1024
+
+# Column limits of currency_rates, for validating rows before they are sent:
+# currency_code is VARCHAR(10) and rate is a 4-byte REAL.
+CURRENCY_CODE_MAX_LENGTH = 10
+REAL_MAX = 3.4028234663852886e38
+
+# Once the schema has been verified it is not checked again in this process. The flag is
+# cleared when the table turns out to be missing (e.g. the database was reset), so the next
+# initialize_schema() runs the checks again.
+_SCHEMA_READY = False
+
+# Connections on which the ins_rate statement has been prepared. Prepared statements live
+# for the database session, so they go away (server-side too) when the connection closes.
+_PREPARED_CONNS = weakref.WeakSet()
+
+def get_pool():
+    """Returns the process-wide connection pool, creating it (and its first connection) on first use."""
+    global POOL
+    with _POOL_LOCK:
+        if POOL is None:
+            POOL = ThreadedConnectionPool(
+                POOL_MINCONN,
+                POOL_MAXCONN,
+                host=DB_HOST,
+                port=DB_PORT,
+                dbname=DB_NAME,
+                user=DB_USER,
+                password=DB_PASSWORD
+            )
+            logging.info("Successfully connected to the PostgreSQL database (connection pool created).")
+        return POOL
+
+def _is_alive(conn) -> bool:
+    """
+    Checks a pooled connection with a trivial query before it is handed out, since the pool
+    itself does not notice a server restart, an idle timeout or a connection dropped by a firewall.
+    The SELECT opens a transaction that the caller's own commit (or the pool's rollback) ends.
+    """
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1;")
+        return True
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        return False
 
 def get_db_connection():
-    """Establishes a connection to the PostgreSQL database."""
-    conn = None
+    """
+    Borrows a connection to the PostgreSQL database from the process-wide pool.
+    A stale pooled connection is discarded and replaced by a fresh one.
+    Hand it back with release_db_connection() instead of closing it.
+    """
     try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            dbname=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
-        logging.info("Successfully connected to the PostgreSQL database.")
+        pool = get_pool()
+        conn = pool.getconn()
+        if not _is_alive(conn):
+            logging.warning("Discarding stale pooled database connection; reconnecting.")
+            pool.putconn(conn, close=True)
+            conn = pool.getconn() # Opens a new connection
+        logging.debug("Borrowed connection from pool.")
         return conn
     except psycopg2.OperationalError as e:
-        logging.error(f"Error connecting to PostgreSQL: {e}")
+        logging.error("Error connecting to PostgreSQL: %s", e)
         raise
     except Exception as e:
-        logging.error(f"An unexpected error occurred during DB connection: {e}")
+        logging.error("An unexpected error occurred during DB connection: %s", e)
         raise
 
+def release_db_connection(conn):
+    """
+    Hands a connection from get_db_connection() back to the pool.
+    The pool rolls back unfinished transactions and discards connections that were closed.
+    """
+    with _POOL_LOCK:
+        pool = POOL
+    if pool is None:
+        conn.close() # The pool was closed while the connection was out
+        return
+    pool.putconn(conn)
+
+@contextmanager
+def borrow_conn():
+    """Borrows a pooled connection for the duration of a with block and always hands it back."""
+    conn = get_db_connection()
+    try:
+        yield conn
+    finally:
+        release_db_connection(conn)
+
+def close_pool():
+    """Closes every pooled connection. The next get_pool() call creates a new pool."""
+    global POOL
+    with _POOL_LOCK:
+        if POOL is not None:
+            POOL.closeall()
+            POOL = None
+            logging.info("Closed PostgreSQL connection pool.")
+
 def initialize_schema(conn):
     """
     Initializes the database schema by creating the currency_rates table if it doesn't exist.
     Adds a unique constraint on (date, currency_code).
+    All checks run server-side in a single DO block, so an up-to-date schema costs one round-trip.
+    Skipped once the schema is known to be ready in this process (see _SCHEMA_READY).
     """
+    global _SCHEMA_READY
+    if _SCHEMA_READY:
+        return
+
+    # Each migration step in the DO block reports itself with RAISE NOTICE
+    del conn.notices[:]
     try:
         with conn.cursor() as cur:
             cur.execute("""
-                CREATE TABLE IF NOT EXISTS currency_rates (
-                    id SERIAL PRIMARY KEY,
-                    date DATE NOT NULL,
-                    currency_code VARCHAR(10) NOT NULL, -- Increased length
-                    rate DECIMAL NOT NULL
-                );
-            """)
-            
-            # Check and alter column type if necessary (for existing tables)
-            cur.execute("""
-                SELECT data_type, character_maximum_length
-                FROM information_schema.columns
-                WHERE table_schema = current_schema()
-                  AND table_name = 'currency_rates'
-                  AND column_name = 'currency_code';
-            """)
-            column_info = cur.fetchone()
-            if column_info:
-                current_type, current_length = column_info
-                # Check if it's varchar and length is 3
-                if current_type == 'character varying' and current_length == 3:
-                    logging.info("Altering currency_code column from VARCHAR(3) to VARCHAR(10)...")
-                    cur.execute("""
+                DO $$
+                BEGIN
+                    CREATE TABLE IF NOT EXISTS currency_rates (
+                        id SERIAL PRIMARY KEY,
+                        date DATE NOT NULL,
+                        -- Widened from VARCHAR(3): the API also returns codes longer than three characters.
+                        -- CHAR(3) would not be smaller: PostgreSQL stores bpchar as varlena too.
+                        currency_code VARCHAR(10) NOT NULL,
+                        rate REAL NOT NULL
+                    );
+
+                    -- Convert rate from arbitrary-precision NUMERIC to 4-byte REAL
+                    IF EXISTS (
+                        SELECT 1
+                        FROM information_schema.columns
+                        WHERE table_schema = current_schema()
+                          AND table_name = 'currency_rates'
+                          AND column_name = 'rate'
+                          AND data_type = 'numeric'
+                    ) THEN
+                        ALTER TABLE currency_rates
+                        ALTER COLUMN rate TYPE REAL USING rate::real;
+                        RAISE NOTICE 'Converted currency_rates.rate from NUMERIC to REAL.';
+                    END IF;
+
+                    -- Widen currency_code on tables created with a narrower column (originally VARCHAR(3))
+                    IF EXISTS (
+                        SELECT 1
+                        FROM information_schema.columns
+                        WHERE table_schema = current_schema()
+                          AND table_name = 'currency_rates'
+                          AND column_name = 'currency_code'
+                          AND character_maximum_length < 10
+                    ) THEN
                         ALTER TABLE currency_rates
                         ALTER COLUMN currency_code TYPE VARCHAR(10);
-                    """)
-                    logging.info("Successfully altered currency_code column type to VARCHAR(10).")
-                elif current_type == 'character varying' and current_length == 10:
-                    logging.info("currency_code column is already VARCHAR(10).")
-                else:
-                    logging.info(f"currency_code column type is {current_type}({current_length}), not altering.")
-
-            # Add unique constraint if it doesn't exist
-            # Check if constraint exists
-            cur.execute("""
-                SELECT conname 
-                FROM pg_constraint 
-                WHERE conrelid = 'currency_rates'::regclass 
-                AND conname = 'uq_date_currency_code';
+                        RAISE NOTICE 'Widened currency_rates.currency_code to VARCHAR(10).';
+                    END IF;
+
+                    IF NOT EXISTS (
+                        SELECT 1
+                        FROM pg_constraint
+                        WHERE conrelid = 'currency_rates'::regclass
+                          AND conname = 'uq_date_currency_code'
+                    ) THEN
+                        ALTER TABLE currency_rates
+                        ADD CONSTRAINT uq_date_currency_code UNIQUE (date, currency_code);
+                        RAISE NOTICE 'Added unique constraint uq_date_currency_code.';
+                    END IF;
+                END
+                $$;
             """)
-            if not cur.fetchone():
-                cur.execute("""
-                    ALTER TABLE currency_rates
-                    ADD CONSTRAINT uq_date_currency_code UNIQUE (date, currency_code);
-                """)
-                logging.info("Added unique constraint uq_date_currency_code to currency_rates table.")
-            else:
-                logging.info("Unique constraint uq_date_currency_code already exists on currency_rates table.")
-            
             conn.commit()
+            for notice in conn.notices:
+                logging.info("Schema migration: %s", notice.strip().removeprefix("NOTICE:").strip())
             logging.info("Database schema initialized successfully (currency_rates table created/verified).")
     except Exception as e:
-        logging.error(f"Error initializing schema: {e}")
+        logging.error("Error initializing schema: %s", e)
         conn.rollback() # Rollback in case of error
         raise
 
-def insert_currency_rate(conn, record_date: date, currency_code: str, rate: float):
+    _SCHEMA_READY = True
+
+def _forget_schema():
+    """Marks the schema as not initialized, after a query found the currency_rates table missing."""
+    global _SCHEMA_READY
+    _SCHEMA_READY = False
+    logging.warning("Table currency_rates is missing; the schema will be initialized again.")
+
+def prepare_statements(conn):
+    """
+    Prepares the single-row insert as the server-side statement ins_rate, once per connection.
+    Later executions skip parsing and planning on the server.
+    """
+    if conn in _PREPARED_CONNS:
+        return
+    with conn.cursor() as cur:
+        cur.execute("""
+            PREPARE ins_rate (date, varchar, real) AS
+            INSERT INTO currency_rates (date, currency_code, rate)
+            VALUES ($1, $2, $3)
+            ON CONFLICT (date, currency_code) DO NOTHING;
+        """)
+    _PREPARED_CONNS.add(conn)
+    logging.info("Prepared statement ins_rate for this connection.")
+
+def insert_currency_rate(conn, record_date: date, currency_code: str, rate: float) -> int:
     """
     Inserts a new currency rate into the database.
     Handles potential duplicate entries by doing nothing if the constraint is violated.
+    Does not commit or roll back: the caller owns the transaction, so an error here
+    leaves it to the caller to decide what happens to its earlier, uncommitted inserts.
+
+    Returns:
+        int: 1 if the row was inserted, 0 if it already existed.
     """
+    try:
+        prepare_statements(conn)
+        with conn.cursor() as cur:
+            # ON CONFLICT DO NOTHING in ins_rate handles duplicates gracefully based on the unique constraint
+            cur.execute("EXECUTE ins_rate (%s, %s, %s);", (record_date, currency_code, rate))
+            if cur.rowcount > 0:
+                logging.debug("Inserted rate for %s on %s: %s", currency_code, record_date, rate)
+            else:
+                logging.debug("Rate for %s on %s already exists. Skipped insertion.", currency_code, record_date)
+            return cur.rowcount
+    except Exception as e:
+        logging.error("Error inserting currency rate for %s on %s: %s", currency_code, record_date, e)
+        if isinstance(e, UndefinedTable):
+            _forget_schema()
+        raise
+
+def rates_exist_for_date(conn, record_date: date) -> bool:
+    """
+    Checks whether any rate is already stored for the given date.
+    A single lookup on the leading column of uq_date_currency_code.
+    """
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1 FROM currency_rates WHERE date = %s LIMIT 1;", (record_date,))
+            return cur.fetchone() is not None
+    except UndefinedTable:
+        _forget_schema()
+        raise
+
+def insert_currency_rates_bulk(conn, rows: list) -> int:
+    """
+    Inserts (date, currency_code, rate) rows in a single batched statement.
+    Existing (date, currency_code) pairs are left untouched.
+
+    Returns:
+        int: The number of rows actually inserted.
+    """
+    if not rows:
+        logging.info("No rates to insert.")
+        return 0
+
     sql = """
         INSERT INTO currency_rates (date, currency_code, rate)
-        VALUES (%s, %s, %s)
-        ON CONFLICT (date, currency_code) DO NOTHING; 
-        -- ON CONFLICT DO NOTHING handles duplicates gracefully based on the unique constraint
+        VALUES %s
+        ON CONFLICT (date, currency_code) DO NOTHING;
     """
     try:
         with conn.cursor() as cur:
-            cur.execute(sql, (record_date, currency_code, rate))
-            conn.commit()
-            if cur.rowcount > 0:
-                logging.info(f"Inserted rate for {currency_code} on {record_date}: {rate}")
-            else:
-                logging.info(f"Rate for {currency_code} on {record_date} already exists. Skipped insertion.")
+            # A single page keeps the whole batch in one statement and one round-trip
+            execute_values(cur, sql, rows, page_size=len(rows))
+            inserted = cur.rowcount
+        conn.commit()
+        logging.info("Inserted %s rates; %s already existed.", inserted, len(rows) - inserted)
+        return inserted
     except Exception as e:
-        logging.error(f"Error inserting currency rate for {currency_code} on {record_date}: {e}")
+        logging.error("Error bulk inserting currency rates: %s", e)
+        if isinstance(e, UndefinedTable):
+            _forget_schema()
         conn.rollback()
         raise
 
+# Characters with a meaning in COPY's text format, and how a data value has to spell them
+_COPY_TEXT_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+def copy_currency_rates(conn, rows: list) -> int:
+    """
+    Loads (date, currency_code, rate) rows with COPY into a temporary staging table
+    and merges them into currency_rates in the same transaction.
+    Existing (date, currency_code) pairs are left untouched.
+
+    Returns:
+        int: The number of rows actually inserted.
+    """
+    if not rows:
+        logging.info("No rates to insert.")
+        return 0
+
+    buf = io.StringIO()
+    for row_date, currency_code, rate in rows:
+        buf.write(f"{row_date}\t{currency_code.translate(_COPY_TEXT_ESCAPES)}\t{rate!r}\n")
+    buf.seek(0)
+
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS stg_rates (
+                    date DATE,
+                    currency_code VARCHAR(10),
+                    rate REAL
+                ) ON COMMIT DROP;
+            """)
+            cur.copy_expert("COPY stg_rates (date, currency_code, rate) FROM STDIN WITH (FORMAT text)", buf)
+            # Merge and count in one statement: inserted rows come back through RETURNING
+            cur.execute("""
+                WITH ins AS (
+                    INSERT INTO currency_rates (date, currency_code, rate)
+                    SELECT date, currency_code, rate FROM stg_rates
+                    ON CONFLICT (date, currency_code) DO NOTHING
+                    RETURNING 1
+                )
+                SELECT
+                    (SELECT count(*) FROM ins) AS inserted,
+                    (SELECT count(*) FROM stg_rates) - (SELECT count(*) FROM ins) AS skipped;
+            """)
+            inserted, skipped = cur.fetchone()
+        conn.commit()
+        logging.info("Inserted %s rates via COPY; %s already existed.", inserted, skipped)
+        return inserted
+    except Exception as e:
+        logging.error("Error copying currency rates: %s", e)
+        if isinstance(e, UndefinedTable):
+            _forget_schema()
+        conn.rollback()
+        raise
+
+def bulk_upsert_rates(conn, rows: list) -> int:
+    """
+    Stores (date, currency_code, rate) rows, picking COPY for large batches
+    and a single multi-row INSERT otherwise.
+
+    Returns:
+        int: The number of rows actually inserted.
+    """
+    if len(rows) >= COPY_THRESHOLD:
+        return copy_currency_rates(conn, rows)
+    return insert_currency_rates_bulk(conn, rows)
+
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
     
     if not all([DB_HOST, DB_NAME, DB_USER, DB_PASSWORD]):
         print("Database connection details not found in environment variables. Please set them in your .env file.")
@@ -141,10 +382,10 @@ if __name__ == "__main__":
                 from datetime import datetime
                 today_date = datetime.utcnow().date()
                 
-                insert_currency_rate(connection, today_date, "EUR", 0.92)
-                insert_currency_rate(connection, today_date, "GBP", 0.79)
-                # Try inserting the same EUR rate again to test ON CONFLICT
-                insert_currency_rate(connection, today_date, "EUR", 0.92) 
+                sample_rates = [("EUR", 0.92), ("GBP", 0.79), ("EUR", 0.92)] # Repeated EUR tests ON CONFLICT
+                inserted = sum(insert_currency_rate(connection, today_date, code, rate) for code, rate in sample_rates)
+                connection.commit()
+                logging.info("Inserted %s sample rates; %s already existed.", inserted, len(sample_rates) - inserted)
                 
                 print("\nFetching a few records to verify (manual check):")
                 with connection.cursor() as cur:
@@ -160,5 +401,5 @@ if __name__ == "__main__":
             print(f"An error occurred during DB manager testing: {e}")
         finally:
             if connection:
-                connection.close()
-                logging.info("Database connection closed.")
+                release_db_connection(connection)
+            close_pool()
@@ -1,122 +1,196 @@
 import logging
+import math
 import os
+import signal
 from datetime import datetime, date as DDate, timezone # Alias to avoid conflict with datetime.date, import timezone
 import time
 
-from apscheduler.schedulers.blocking import BlockingScheduler
-from dotenv import load_dotenv
+from apscheduler.schedulers.background import BackgroundScheduler
+from psycopg2.errors import UndefinedTable
 
 # Assuming currency_fetcher and db_manager are in the same 'app' directory
 from . import currency_fetcher
 from . import db_manager
+from .config import CFG, ConfigError
 
-# Load environment variables from .env file
-load_dotenv()
-
-# Configure basic logging
+# Configure logging once for the whole application; the app modules log through the root logger
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("DailyCurrencyRateApp")
-logger.setLevel(logging.INFO)
-handler = logging.StreamHandler()
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-handler.setFormatter(formatter)
-logger.addHandler(handler)
-
 
-def fetch_and_store_rates_job():
+def _initialize_database():
     """
-    The main job to be scheduled: fetches currency rates and stores them in the database.
+    Makes sure the schema exists before the first job runs, and opens the connection pool
+    so the first run does not pay for the handshake. On failure the job tries again.
     """
-    logger.info("Starting daily currency rate fetch and store job...")
+    logger.info("Initializing database schema (if needed)...")
+    try:
+        with db_manager.borrow_conn() as db_conn:
+            db_manager.initialize_schema(db_conn) # Idempotent
+    except Exception as e:
+        logger.error("Could not initialize the database schema: %s", e)
 
-    api_key = os.getenv("CURRENCY_API_KEY")
-    if not api_key:
-        logger.error("CURRENCY_API_KEY not found in environment. Job cannot run.")
-        return
 
-    # 1. Fetch currency rates
-    logger.info("Fetching latest currency rates...")
-    rates_data = currency_fetcher.fetch_latest_rates(api_key=api_key, base_currency="USD")
+def _utcnow() -> datetime:
+    """Returns the current time in UTC. Kept separate so tests can pin the clock."""
+    return datetime.now(timezone.utc)
+
+
+def _parse_rates_response(rates_data: dict):
+    """
+    Validates the API response and determines the date the rates apply to.
 
+    Returns:
+        tuple: (record_date, rates) if the response is usable, otherwise None.
+    """
     if "error" in rates_data:
-        logger.error(f"Failed to fetch currency rates: {rates_data['error']}")
+        logger.error("Failed to fetch currency rates: %s", rates_data['error'])
         if "details" in rates_data:
-            logger.error(f"Details: {rates_data['details']}")
-        return
+            logger.error("Details: %s", rates_data['details'])
+        return None
     
     if "rates" not in rates_data or not isinstance(rates_data["rates"], dict): # Check for 'rates' key
-        logger.error(f"Fetched rates data is not in the expected format or 'rates' key is missing: {rates_data}")
-        return
+        logger.error("Fetched rates data is not in the expected format or 'rates' key is missing: %s", rates_data)
+        return None
 
     # Determine the date for the rates from the 'updated' timestamp.
     record_timestamp = rates_data.get("updated")
-    logger.info(f"Raw 'updated' timestamp from API: {record_timestamp}") # Log raw timestamp
+    logger.info("Raw 'updated' timestamp from API: %s", record_timestamp) # Log raw timestamp
     if record_timestamp:
         try:
             int_timestamp = int(record_timestamp)
-            logger.info(f"Integer-converted timestamp: {int_timestamp}") # Log int timestamp
+            logger.info("Integer-converted timestamp: %s", int_timestamp) # Log int timestamp
             # Use timezone-aware datetime conversion
             record_date = datetime.fromtimestamp(int_timestamp, timezone.utc).date()
         except (ValueError, TypeError):
-            logger.warning(f"Could not parse date from API 'updated' timestamp: {record_timestamp}. Using current UTC date.")
-            record_date = datetime.now(timezone.utc).date()
+            logger.warning("Could not parse date from API 'updated' timestamp: %s. Using current UTC date.", record_timestamp)
+            record_date = _utcnow().date()
     else:
         logger.warning("No 'updated' timestamp in API response. Using current UTC date.")
-        record_date = datetime.now(timezone.utc).date()
+        record_date = _utcnow().date()
+
+    return record_date, rates_data["rates"]
+
+
+def _build_rate_rows(record_date, rates: dict) -> list:
+    """
+    Converts a {currency_code: rate} mapping into (date, currency_code, rate) rows.
+    Entries the database would reject are left out and logged once, since a single bad
+    row would otherwise fail the whole batch: codes longer than the column, rates that
+    are not numbers, not finite, or out of REAL's range.
+    """
+    rows = []
+    bad_codes = []
+    for currency_code, rate_value in rates.items():
+        try:
+            rate = float(rate_value)
+        except (TypeError, ValueError):
+            rate = math.nan
+        if (len(currency_code) > db_manager.CURRENCY_CODE_MAX_LENGTH
+                or not math.isfinite(rate) or abs(rate) > db_manager.REAL_MAX):
+            bad_codes.append(currency_code)
+            continue
+        rows.append((record_date, currency_code, rate))
+    if bad_codes:
+        logger.error("Skipping %s invalid rates: %s", len(bad_codes), ', '.join(bad_codes))
+    return rows
+
+
+def _store_rate_rows(db_conn, record_date, rows: list):
+    """Inserts the rows unless rates for record_date are already stored."""
+    if db_manager.rates_exist_for_date(db_conn, record_date):
+        # Batches are committed as a whole, so one stored row means the date is done
+        logger.info("Rates for %s already present; skipping insertion.", record_date)
+        return
+    logger.info("Inserting rates for date: %s...", record_date)
+    # All rates go to the database in one batch (INSERT or COPY) and one commit
+    db_manager.bulk_upsert_rates(db_conn, rows)
+    logger.info("Finished processing rates for insertion.")
+
+
+def fetch_and_store_rates_job():
+    """
+    The main job to be scheduled: fetches currency rates and stores them in the database.
+    The schema is set up at startup (see run_application_logic); the job's own
+    initialize_schema call is free once that succeeded, and retries it if it did not.
+    """
+    logger.info("Starting daily currency rate fetch and store job...")
+
+    api_key = CFG.api_key
+    if not api_key:
+        logger.error("CURRENCY_API_KEY not found in environment. Job cannot run.")
+        return
+
+    # 1. Fetch currency rates
+    logger.info("Fetching latest currency rates...")
+    rates_data = currency_fetcher.fetch_latest_rates(api_key=api_key, base_currency="USD")
+    parsed = _parse_rates_response(rates_data)
+    if not parsed:
+        return
+    record_date, rates = parsed
+    if not rates:
+        logger.info("No rates returned for %s; skipping insertion.", record_date)
+        return
+    # Validate before any database work so the insert only sees clean rows
+    rows = _build_rate_rows(record_date, rates)
+    if not rows:
+        logger.error("None of the fetched rates is valid; skipping insertion.")
+        return
 
     # 2. Store rates in database
-    db_conn = None
     try:
-        logger.info("Connecting to the database...")
-        db_conn = db_manager.get_db_connection()
-        if db_conn:
-            logger.info("Initializing database schema (if needed)...")
-            db_manager.initialize_schema(db_conn) # Idempotent
-
-            logger.info(f"Inserting rates for date: {record_date}...")
-            # inserted_count = 0
-            # skipped_count = 0
-            for currency_code, rate_value in rates_data["rates"].items(): # Iterate through 'rates'
-                try:
-                    # Rate value is directly available
-                    db_manager.insert_currency_rate(db_conn, record_date, currency_code, float(rate_value))
-                    # insert_currency_rate handles its own logging for success/skip/failure per item
-                except ValueError:
-                    logger.error(f"Could not convert rate '{rate_value}' to float for currency {currency_code}. Skipping.")
-                except Exception as e:
-                    logger.error(f"Error processing or inserting rate for {currency_code}: {e}")
-            
-            logger.info("Finished processing rates for insertion.")
+        logger.info("Borrowing a database connection from the pool...")
+        with db_manager.borrow_conn() as db_conn:
+            db_manager.initialize_schema(db_conn) # No-op once the schema is ready
+            try:
+                _store_rate_rows(db_conn, record_date, rows)
+            except UndefinedTable:
+                # The table went missing since the schema was set up (e.g. the database was reset):
+                # rebuild it and retry once, so today's rates are not lost
+                logger.warning("Table currency_rates is missing; recreating the schema and retrying.")
+                db_conn.rollback() # The failed statement aborted the transaction
+                db_manager.initialize_schema(db_conn)
+                _store_rate_rows(db_conn, record_date, rows)
 
     except Exception as e:
-        logger.error(f"An error occurred in the database operations: {e}")
-    finally:
-        if db_conn:
-            db_conn.close()
-            logger.info("Database connection closed.")
+        logger.error("An error occurred in the database operations: %s", e)
     
     logger.info("Daily currency rate fetch and store job finished.")
 
 
 def run_application_logic():
     """Handles the main application startup logic: run once or schedule."""
+    try:
+        CFG.validate() # Fail fast on missing settings instead of at the first scheduled run
+    except ConfigError as e:
+        logger.error("%s", e)
+        raise SystemExit(1)
+
     # Simplified startup for now: run the job once if SCRIPT_MODE is 'run_once', otherwise start scheduler.
     script_mode = os.getenv("SCRIPT_MODE", "schedule").lower()
 
     if script_mode == "run_once":
         logger.info("SCRIPT_MODE is 'run_once'. Running the job immediately.")
+        _initialize_database()
         fetch_and_store_rates_job()
+        db_manager.close_pool()
         logger.info("Job finished. Exiting.")
     elif script_mode == "schedule":
         logger.info("SCRIPT_MODE is 'schedule'. Scheduler is active.")
-        scheduler = BlockingScheduler(timezone="UTC")
+        scheduler = BackgroundScheduler(timezone="UTC")
+        _initialize_database()
         scheduler.add_job(fetch_and_store_rates_job, 'cron', hour=6, minute=0)
+
+        scheduler.start()
         logger.info("Job scheduled daily at 06:00 UTC. Press Ctrl+C to exit.")
         try:
-            scheduler.start()
+            signal.pause() # Jobs run in the scheduler's threads; the main thread just waits
         except (KeyboardInterrupt, SystemExit):
             logger.info("Scheduler stopped.")
+        finally:
+            scheduler.shutdown()
+            db_manager.close_pool()
     else:
-        logger.error(f"Invalid SCRIPT_MODE: {script_mode}. Set to 'run_once' or 'schedule'.")
+        logger.error("Invalid SCRIPT_MODE: %s. Set to 'run_once' or 'schedule'.", script_mode)
 
 if __name__ == "__main__":
     logger.info("Application starting...")
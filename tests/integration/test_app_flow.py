@@ -52,7 +52,7 @@ def setup_test_database(db_connection_info):
         # Optional: Clean up after test, e.g., by truncating again or dropping tables
         # For this example, we'll rely on the next test run to clean.
         if conn:
-            conn.close()
+            db_manager.release_db_connection(conn) # Back to the pool the job borrows from
 
 
 @patch('app.currency_fetcher.fetch_latest_rates')
@@ -81,7 +81,7 @@ def test_fetch_and_store_integration(mock_fetch_rates, db_connection_info, setup
     app_main.fetch_and_store_rates_job()
 
     # Verify the data was inserted into the database
-    conn = db_manager.get_db_connection() # Get a new connection to check data
+    conn = db_manager.get_db_connection() # Borrow a connection to check data
     assert conn is not None, "Failed to connect to DB for verification"
     
     try:
@@ -105,7 +105,7 @@ def test_fetch_and_store_integration(mock_fetch_rates, db_connection_info, setup
             
     finally:
         if conn:
-            conn.close()
+            db_manager.release_db_connection(conn)
 
     # Verify that fetch_latest_rates was called
     mock_fetch_rates.assert_called_once()
@@ -0,0 +1,64 @@
+"""Lightweight stand-ins for psycopg2 connections and cursors used by the unit tests."""
+from types import SimpleNamespace
+
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+
+class FakeCursor:
+    """Records executed statements and plays back queued fetchone() results."""
+
+    def __init__(self, fetchone_results=()):
+        self.executed = [] # (sql, params) per execute() call
+        self.copied = [] # (sql, data) per copy_expert() call
+        self.fetchone_results = list(fetchone_results)
+        self.fetches = 0 # fetchone() calls
+        self.rowcount = -1
+        self.execute_error = None # Raised by execute() when set
+        self.copy_error = None # Raised by copy_expert() when set
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+        if self.execute_error is not None:
+            raise self.execute_error
+
+    def copy_expert(self, sql, file):
+        if self.copy_error is not None:
+            raise self.copy_error
+        self.copied.append((sql, file.read()))
+
+    def fetchone(self):
+        self.fetches += 1
+        return self.fetchone_results.pop(0) if self.fetchone_results else None
+
+
+class FakeConn:
+    """A connection whose every cursor() is the same FakeCursor; counts commits, rollbacks and closes."""
+
+    def __init__(self, fetchone_results=()):
+        self.cursor_obj = FakeCursor(fetchone_results)
+        self.commits = 0
+        self.rollbacks = 0
+        self.closes = 0
+        self.closed = 0
+        self.notices = [] # Server NOTICE messages, as psycopg2 collects them
+        # Read by the connection pool when a connection is handed back
+        self.info = SimpleNamespace(transaction_status=TRANSACTION_STATUS_IDLE)
+
+    def cursor(self):
+        return self.cursor_obj
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closes += 1
+        self.closed = 1
@@ -0,0 +1,115 @@
+import os
+import pytest
+
+from app import config
+
+@pytest.fixture(autouse=True)
+def no_env_file(monkeypatch, tmp_path):
+    """Fixture to keep a developer's real .env file out of these tests."""
+    monkeypatch.setattr(config, "ENV_FILE", str(tmp_path / "missing.env"))
+
+@pytest.fixture
+def mock_env_settings(monkeypatch):
+    """Fixture to provide a complete set of settings through the environment."""
+    settings = {
+        "CURRENCY_API_KEY": "test_api_key",
+        "DB_HOST": "testhost",
+        "DB_PORT": "6543",
+        "DB_NAME": "testdb",
+        "DB_USER": "testuser",
+        "DB_PASSWORD": "testpass",
+    }
+    for key, value in settings.items():
+        monkeypatch.setenv(key, value)
+    return settings
+
+def test_config_load_reads_environment(mock_env_settings):
+    """Test that Config.load picks up every setting from the environment."""
+    cfg = config.Config.load()
+
+    assert cfg.api_key == "test_api_key"
+    assert cfg.db_host == "testhost"
+    assert cfg.db_port == 6543 # Converted to int
+    assert cfg.db_name == "testdb"
+    assert cfg.db_user == "testuser"
+    assert cfg.db_password == "testpass"
+
+def test_config_load_defaults(mock_env_settings, monkeypatch):
+    """Test the defaults used when optional settings are missing."""
+    monkeypatch.delenv("DB_PORT")
+
+    cfg = config.Config.load()
+
+    assert cfg.db_port == 5432
+
+def test_config_is_frozen(mock_env_settings):
+    """Test that settings cannot be changed after loading."""
+    cfg = config.Config.load()
+
+    with pytest.raises(AttributeError):
+        cfg.api_key = "other_key"
+
+def test_load_env_parses_file(tmp_path, monkeypatch):
+    """Test the .env parser on comments, quoting, export prefixes and inline comments."""
+    for key in ("DB_HOST", "DB_NAME", "DB_USER", "DB_PASSWORD", "CURRENCY_API_KEY", "SCRIPT_MODE"):
+        monkeypatch.delenv(key, raising=False)
+    env_file = tmp_path / ".env"
+    env_file.write_text(
+        "# PostgreSQL Connection Details\n"
+        "DB_HOST=localhost\n"
+        "\n"
+        "export DB_NAME = mydb\n"
+        "DB_USER=\"quoted user\"\n"
+        "DB_PASSWORD='p#ss=word'\n"
+        "CURRENCY_API_KEY=\"secret\" # note\n"
+        "SCRIPT_MODE=schedule # 'schedule' or 'run_once'\n"
+        "not a setting\n"
+    )
+
+    config._load_env(str(env_file))
+
+    assert os.environ["DB_HOST"] == "localhost"
+    assert os.environ["DB_NAME"] == "mydb"
+    assert os.environ["DB_USER"] == "quoted user"
+    assert os.environ["DB_PASSWORD"] == "p#ss=word"
+    assert os.environ["CURRENCY_API_KEY"] == "secret" # Quotes stripped despite the comment
+    assert os.environ["SCRIPT_MODE"] == "schedule"
+
+def test_load_env_keeps_existing_variables(tmp_path, monkeypatch):
+    """Test that variables already in the environment win over the .env file."""
+    monkeypatch.setenv("DB_HOST", "from_environment")
+    env_file = tmp_path / ".env"
+    env_file.write_text("DB_HOST=from_file\n")
+
+    config._load_env(str(env_file))
+
+    assert os.environ["DB_HOST"] == "from_environment"
+
+def test_load_env_missing_file(tmp_path):
+    """Test that a missing .env file is not an error."""
+    config._load_env(str(tmp_path / "missing.env"))
+
+def test_config_load_empty_port_uses_default(mock_env_settings, monkeypatch):
+    """Test that an empty DB_PORT= falls back to the default port."""
+    monkeypatch.setenv("DB_PORT", "")
+
+    assert config.Config.load().db_port == 5432
+
+def test_config_load_invalid_port(mock_env_settings, monkeypatch):
+    """Test that a non-numeric DB_PORT is reported by name."""
+    monkeypatch.setenv("DB_PORT", "postgres")
+
+    with pytest.raises(config.ConfigError, match="DB_PORT must be a port number, got 'postgres'"):
+        config.Config.load()
+
+def test_config_validate_complete(mock_env_settings):
+    """Test that a complete configuration validates."""
+    config.Config.load().validate()
+
+def test_config_validate_missing_settings(mock_env_settings, monkeypatch):
+    """Test that validate names every missing required setting."""
+    monkeypatch.delenv("CURRENCY_API_KEY")
+    monkeypatch.setenv("DB_PASSWORD", "")
+
+    with pytest.raises(config.ConfigError, match="Missing required settings: CURRENCY_API_KEY, DB_PASSWORD"):
+        config.Config.load().validate()
@@ -2,6 +2,7 @@ import pytest
 import os # Import os to get env variables
 from unittest.mock import patch, MagicMock
 import requests # Import requests for exception types
+import orjson
 
 # Adjust the import path according to your project structure
 # This assumes 'app' is a package and 'currency_fetcher' is a module within it.
@@ -14,6 +15,13 @@ def mock_env_api_key(monkeypatch):
     monkeypatch.setenv("CURRENCY_API_KEY", "test_api_key")
     return "test_api_key" # Return the key for use in tests
 
+@pytest.fixture(autouse=True)
+def clear_rates_cache():
+    """Fixture to keep the module-level response cache from leaking between tests."""
+    currency_fetcher._CACHE.clear()
+    yield
+    currency_fetcher._CACHE.clear()
+
 def test_fetch_latest_rates_success(mock_env_api_key, mocker):
     """
     Test successful fetching and parsing of currency rates.
@@ -21,7 +29,7 @@ def test_fetch_latest_rates_success(mock_env_api_key, mocker):
     mock_response = MagicMock()
     mock_response.status_code = 200
     # Consistent with API documentation: Unix timestamp for 'updated', direct rates
-    mock_response.json.return_value = {
+    mock_response.content = orjson.dumps({
         "valid": True,
         "updated": 1609459200, # Example Unix timestamp for 2024-01-01T00:00:00Z
         "base": "USD",
@@ -29,11 +37,11 @@ def test_fetch_latest_rates_success(mock_env_api_key, mocker):
             "EUR": 0.9,
             "GBP": 0.8
         }
-    }
+    })
     
-    # Patch requests.get within the currency_fetcher module
+    # Patch the shared session's get within the currency_fetcher module
     # Assign the mock to a variable to assert calls on it, more robustly
-    mock_get = mocker.patch('app.currency_fetcher.requests.get', return_value=mock_response)
+    mock_get = mocker.patch('app.currency_fetcher._SESSION.get', return_value=mock_response)
     
     result = currency_fetcher.fetch_latest_rates(api_key=mock_env_api_key)
     
@@ -44,10 +52,11 @@ def test_fetch_latest_rates_success(mock_env_api_key, mocker):
     assert "GBP" in result.get("rates", {})
     assert result.get("rates", {}).get("GBP") == 0.8
     
-    # Verify that requests.get was called correctly
+    # Verify that the session's get was called correctly
     mock_get.assert_called_once_with(
         currency_fetcher.API_BASE_URL,
-        params={"key": mock_env_api_key, "base": "USD"} # Corrected parameter names
+        params={"key": mock_env_api_key, "base": "USD"}, # Corrected parameter names
+        timeout=currency_fetcher.REQUEST_TIMEOUT
     )
 
 def test_fetch_latest_rates_api_error(mock_env_api_key, mocker):
@@ -58,25 +67,25 @@ def test_fetch_latest_rates_api_error(mock_env_api_key, mocker):
     mock_response.status_code = 401
     mock_response.raise_for_status.side_effect = requests.exceptions.HTTPError("401 Client Error")
 
-    mocker.patch('app.currency_fetcher.requests.get', return_value=mock_response)
+    mocker.patch('app.currency_fetcher._SESSION.get', return_value=mock_response)
     
     result = currency_fetcher.fetch_latest_rates(api_key=mock_env_api_key)
     
     assert "error" in result
     assert result["status_code"] == 401
-    currency_fetcher.requests.get.assert_called_once()
+    currency_fetcher._SESSION.get.assert_called_once()
 
 def test_fetch_latest_rates_connection_error(mock_env_api_key, mocker):
     """
     Test handling of a connection error.
     """
-    mocker.patch('app.currency_fetcher.requests.get', side_effect=requests.exceptions.ConnectionError("Test Connection Error"))
+    mocker.patch('app.currency_fetcher._SESSION.get', side_effect=requests.exceptions.ConnectionError("Test Connection Error"))
     
     result = currency_fetcher.fetch_latest_rates(api_key=mock_env_api_key)
     
     assert "error" in result
     assert "Connection error" in result["error"]
-    currency_fetcher.requests.get.assert_called_once()
+    currency_fetcher._SESSION.get.assert_called_once()
 
 def test_fetch_latest_rates_json_decode_error(mock_env_api_key, mocker):
     """
@@ -84,15 +93,15 @@ def test_fetch_latest_rates_json_decode_error(mock_env_api_key, mocker):
     """
     mock_response = MagicMock()
     mock_response.status_code = 200
-    mock_response.json.side_effect = ValueError("Decoding JSON has failed")
+    mock_response.content = b"<html>Not JSON</html>"
 
-    mocker.patch('app.currency_fetcher.requests.get', return_value=mock_response)
+    mocker.patch('app.currency_fetcher._SESSION.get', return_value=mock_response)
     
     result = currency_fetcher.fetch_latest_rates(api_key=mock_env_api_key)
     
     assert "error" in result
     assert "JSON decode error" in result["error"]
-    currency_fetcher.requests.get.assert_called_once()
+    currency_fetcher._SESSION.get.assert_called_once()
 
 def test_fetch_latest_rates_missing_updated_or_rates(mock_env_api_key, mocker):
     """
@@ -100,31 +109,32 @@ def test_fetch_latest_rates_missing_updated_or_rates(mock_env_api_key, mocker):
     """
     mock_response_no_updated = MagicMock()
     mock_response_no_updated.status_code = 200
-    mock_response_no_updated.json.return_value = {
+    mock_response_no_updated.content = orjson.dumps({
         "valid": True,
         "base": "USD",
         "rates": {"EUR": 0.9} # Missing 'updated'
-    }
+    })
     
     mock_response_no_rates = MagicMock()
     mock_response_no_rates.status_code = 200
-    mock_response_no_rates.json.return_value = {
+    mock_response_no_rates.content = orjson.dumps({
         "valid": True,
         "updated": 1609459200, # Has 'updated'
         "base": "USD" # Missing 'rates'
-    }
+    })
 
     # Test with missing 'updated'
-    mock_get_no_updated = mocker.patch('app.currency_fetcher.requests.get', return_value=mock_response_no_updated)
+    mock_get_no_updated = mocker.patch('app.currency_fetcher._SESSION.get', return_value=mock_response_no_updated)
     result_no_updated = currency_fetcher.fetch_latest_rates(api_key=mock_env_api_key)
     assert "error" not in result_no_updated # fetch_latest_rates returns the JSON as is
     assert result_no_updated.get("rates", {}).get("EUR") == 0.9
     assert "updated" not in result_no_updated
     mock_get_no_updated.assert_called_once()
     mock_get_no_updated.reset_mock() # Reset mock for the next call in the same test
+    currency_fetcher._CACHE.clear() # Otherwise the second call is served from the cache
 
     # Test with missing 'rates'
-    mock_get_no_rates = mocker.patch('app.currency_fetcher.requests.get', return_value=mock_response_no_rates)
+    mock_get_no_rates = mocker.patch('app.currency_fetcher._SESSION.get', return_value=mock_response_no_rates)
     result_no_rates = currency_fetcher.fetch_latest_rates(api_key=mock_env_api_key)
     assert "error" not in result_no_rates # fetch_latest_rates returns the JSON as is
     assert result_no_rates.get("updated") == 1609459200
@@ -135,7 +145,7 @@ def test_fetch_latest_rates_no_api_key(mocker):
     """
     Test behavior when an empty or None API_KEY is passed.
     """
-    mock_get = mocker.patch('app.currency_fetcher.requests.get')
+    mock_get = mocker.patch('app.currency_fetcher._SESSION.get')
 
     # Test with None API key
     result_none_key = currency_fetcher.fetch_latest_rates(api_key=None)
@@ -148,3 +158,86 @@ def test_fetch_latest_rates_no_api_key(mocker):
     assert "error" in result_empty_key
     assert result_empty_key["error"] == "API key not configured"
     mock_get.assert_not_called() # Should still be not called in total for this test case
+
+
+def test_fetch_latest_rates_served_from_cache(mock_env_api_key, mocker):
+    """
+    Test that a second call within the TTL is served from the cache without an HTTP request.
+    """
+    mock_response = MagicMock()
+    mock_response.status_code = 200
+    mock_response.content = orjson.dumps({"valid": True, "updated": 1609459200, "base": "USD", "rates": {"EUR": 0.9}})
+    mock_get = mocker.patch('app.currency_fetcher._SESSION.get', return_value=mock_response)
+
+    first = currency_fetcher.fetch_latest_rates(api_key=mock_env_api_key)
+    second = currency_fetcher.fetch_latest_rates(api_key=mock_env_api_key)
+
+    assert second == first
+    mock_get.assert_called_once()
+
+def test_fetch_latest_rates_cache_expires(mock_env_api_key, mocker):
+    """
+    Test that a cached response older than the TTL triggers a new HTTP request.
+    """
+    mock_response = MagicMock()
+    mock_response.status_code = 200
+    mock_response.content = orjson.dumps({"valid": True, "updated": 1609459200, "base": "USD", "rates": {"EUR": 0.9}})
+    mock_get = mocker.patch('app.currency_fetcher._SESSION.get', return_value=mock_response)
+    mock_monotonic = mocker.patch('app.currency_fetcher.time.monotonic', return_value=1000.0)
+
+    currency_fetcher.fetch_latest_rates(api_key=mock_env_api_key)
+    mock_monotonic.return_value = 1000.0 + currency_fetcher._CACHE_TTL
+    currency_fetcher.fetch_latest_rates(api_key=mock_env_api_key)
+
+    assert mock_get.call_count == 2
+
+def test_fetch_latest_rates_error_payload_not_cached(mock_env_api_key, mocker):
+    """
+    Test that a 2xx response carrying a provider-side error is not cached or served as stale rates later.
+    """
+    mock_response = MagicMock()
+    mock_response.status_code = 200
+    mock_response.content = orjson.dumps({"valid": False, "error": {"code": 429, "message": "Quota exceeded"}})
+    mock_get = mocker.patch('app.currency_fetcher._SESSION.get', return_value=mock_response)
+
+    first = currency_fetcher.fetch_latest_rates(api_key=mock_env_api_key)
+    currency_fetcher.fetch_latest_rates(api_key=mock_env_api_key)
+
+    assert "error" in first # Returned to the caller as is
+    assert mock_get.call_count == 2 # The retry goes to the API again
+    assert "USD" not in currency_fetcher._CACHE
+
+def test_fetch_latest_rates_stale_cache_on_connection_error(mock_env_api_key, mocker):
+    """
+    Test that an expired cached response is returned, marked stale, when the API is unreachable.
+    """
+    cached = {"valid": True, "updated": 1609459200, "base": "USD", "rates": {"EUR": 0.9}}
+    currency_fetcher._CACHE["USD"] = (-currency_fetcher._CACHE_TTL, cached) # Long expired
+    mocker.patch('app.currency_fetcher._SESSION.get', side_effect=requests.exceptions.ConnectionError("Test Connection Error"))
+
+    result = currency_fetcher.fetch_latest_rates(api_key=mock_env_api_key)
+
+    assert "error" not in result
+    assert result["stale"] is True
+    assert result["rates"] == {"EUR": 0.9}
+    assert "stale" not in cached # The cached copy itself is not modified
+
+def test_session_retries_transient_failures():
+    """
+    Test that the shared session retries rate limiting and server errors on GET with backoff.
+    """
+    adapter = currency_fetcher._SESSION.get_adapter(currency_fetcher.API_BASE_URL)
+    retry = adapter.max_retries
+
+    assert retry.total == 3
+    assert retry.backoff_factor == 0.5
+    assert set(retry.status_forcelist) == {429, 500, 502, 503, 504}
+    assert "GET" in retry.allowed_methods
+    assert retry.raise_on_status is False # Final error response still reaches raise_for_status
+    assert retry.respect_retry_after_header is False # A long Retry-After must not stall the job
+
+    delays = []
+    for _ in range(retry.total):
+        retry = retry.increment(method="GET", url=currency_fetcher.API_BASE_URL)
+        delays.append(retry.get_backoff_time())
+    assert delays == [0, 1.0, 2.0]
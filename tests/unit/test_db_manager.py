@@ -1,57 +1,71 @@
 import pytest
-from unittest.mock import patch, MagicMock, call
 import psycopg2 # For exception types
 
 # Adjust the import path according to your project structure
 from app import db_manager
+from tests.unit.fakes import FakeConn
 
-# mock_env_db_credentials fixture is removed as patching is done directly in tests.
+# SQL the tests expect db_manager to send; kept here so a change to a statement touches one place.
+_CREATE_TABLE_SQL = "CREATE TABLE IF NOT EXISTS currency_rates"
+_WIDEN_CHECK_SQL = "character_maximum_length < 10" # Any narrower currency_code column is widened
+_ALTER_COLUMN_SQL = "ALTER COLUMN currency_code TYPE VARCHAR(10)"
+_RATE_COLUMN_SQL = "rate REAL NOT NULL"
+_ALTER_RATE_SQL = "ALTER COLUMN rate TYPE REAL USING rate::real"
+_ADD_CONSTRAINT_SQL = "ADD CONSTRAINT uq_date_currency_code UNIQUE (date, currency_code)"
+_PREPARE_SQL = "PREPARE ins_rate"
+_INSERT_SQL = "EXECUTE ins_rate (%s, %s, %s);"
+_RATES_EXIST_SQL = "SELECT 1 FROM currency_rates WHERE date = %s LIMIT 1;"
 
 @pytest.fixture
 def mock_db_connection(mocker):
-    """Fixture to mock the database connection and cursor."""
-    mock_conn = MagicMock()
-    mock_cursor = MagicMock()
-    mock_conn.cursor.return_value = mock_cursor
-    mocker.patch('app.db_manager.psycopg2.connect', return_value=mock_conn)
-    # Mock the __enter__ and __exit__ methods for the cursor context manager
-    mock_cursor.__enter__.return_value = mock_cursor
-    mock_cursor.__exit__.return_value = None
-    return mock_conn, mock_cursor
-
-def test_get_db_connection_success(mocker, mock_db_connection): # Removed mock_env_db_credentials
+    """Fixture to fake the database connection; its cursor is conn.cursor_obj."""
+    conn = FakeConn(fetchone_results=[])
+    mocker.patch('app.db_manager.psycopg2.connect', return_value=conn)
+    return conn
+
+@pytest.fixture
+def db_env(monkeypatch):
+    """Fixture to point the module-level DB_* settings at test credentials."""
+    creds = {
+        'DB_HOST': 'testhost',
+        'DB_PORT': 5432, # An int, as Config provides it
+        'DB_NAME': 'testdb',
+        'DB_USER': 'testuser',
+        'DB_PASSWORD': 'testpass',
+    }
+    for name, value in creds.items():
+        monkeypatch.setattr(db_manager, name, value)
+    return creds
+
+@pytest.fixture(autouse=True)
+def reset_pool(monkeypatch):
+    """Fixture to start every test without a connection pool left over from another test."""
+    monkeypatch.setattr(db_manager, "POOL", None)
+
+@pytest.fixture(autouse=True)
+def schema_not_ready(monkeypatch):
+    """Fixture to start every test with an uninitialized schema."""
+    monkeypatch.setattr(db_manager, "_SCHEMA_READY", False)
+
+def test_get_db_connection_success(db_env, mock_db_connection):
     """Test successful database connection."""
-    conn_fixture, _ = mock_db_connection
-
-    # Patch module-level variables in db_manager
-    mocker.patch('app.db_manager.DB_HOST', 'testhost')
-    mocker.patch('app.db_manager.DB_PORT', '5432')
-    mocker.patch('app.db_manager.DB_NAME', 'testdb')
-    mocker.patch('app.db_manager.DB_USER', 'testuser')
-    mocker.patch('app.db_manager.DB_PASSWORD', 'testpass')
-    
+    conn_fixture = mock_db_connection
+
     # Call the function that uses psycopg2.connect
     actual_conn = db_manager.get_db_connection()
     
     # Assert that psycopg2.connect was called with the correct parameters
     db_manager.psycopg2.connect.assert_called_once_with(
         host="testhost",
-        port="5432",
+        port=5432,
         dbname="testdb",
         user="testuser",
         password="testpass"
     )
     assert actual_conn == conn_fixture # Ensure the mocked connection is returned
 
-def test_get_db_connection_failure(mocker): # Removed mock_env_db_credentials
+def test_get_db_connection_failure(mocker, db_env):
     """Test database connection failure."""
-    # Patch module-level variables for completeness, though connection will fail before using them fully
-    mocker.patch('app.db_manager.DB_HOST', 'testhost_fail')
-    mocker.patch('app.db_manager.DB_PORT', '1234')
-    mocker.patch('app.db_manager.DB_NAME', 'testdb_fail')
-    mocker.patch('app.db_manager.DB_USER', 'testuser_fail')
-    mocker.patch('app.db_manager.DB_PASSWORD', 'testpass_fail')
-
     mocker.patch('app.db_manager.psycopg2.connect', side_effect=psycopg2.OperationalError("Connection failed"))
     
     with pytest.raises(psycopg2.OperationalError, match="Connection failed"):
@@ -59,212 +73,361 @@ def test_get_db_connection_failure(mocker): # Removed mock_env_db_credentials
     
     db_manager.psycopg2.connect.assert_called_once() # Check it was attempted
 
-def test_initialize_schema_success_constraint_exists(mock_db_connection):
-    """Test schema initialization when constraint already exists."""
-    conn, cursor = mock_db_connection
-    
-    # Simulate the column type check - assume it's already VARCHAR(10)
-    # The first fetchone is for column info, second for constraint check (constraint exists)
-    cursor.fetchone.side_effect = [('character varying', 10), (1,)]
-    
-    db_manager.initialize_schema(conn)
-    
-    # Check that CREATE TABLE IF NOT EXISTS is called
-    # Exact SQL string from app/db_manager.py, including leading newline and indentation
-    # Reflects the current implementation with VARCHAR(10)
-    create_table_sql_exact = """
-                CREATE TABLE IF NOT EXISTS currency_rates (
-                    id SERIAL PRIMARY KEY,
-                    date DATE NOT NULL,
-                    currency_code VARCHAR(10) NOT NULL, -- Increased length
-                    rate DECIMAL NOT NULL
-                );
-            """
-    
-    # Simulate the column type check - assume it's already VARCHAR(10) or doesn't need alteration
-    # Check that the query to check for constraint existence is called
-    # Exact SQL string from app/db_manager.py
-    check_constraint_sql_exact = """
-                SELECT conname 
-                FROM pg_constraint 
-                WHERE conrelid = 'currency_rates'::regclass 
-                AND conname = 'uq_date_currency_code';
-            """
-        
-    cursor.execute.assert_any_call(create_table_sql_exact)
-    cursor.execute.assert_any_call(check_constraint_sql_exact)
-    
-    # Ensure ADD CONSTRAINT is NOT called
-    add_constraint_sql = "ALTER TABLE currency_rates ADD CONSTRAINT uq_date_currency_code UNIQUE (date, currency_code);"
-    for executed_call in cursor.execute.call_args_list:
-        # Ensure the SQL string being executed is not the add_constraint_sql
-        # executed_call[0] is the args tuple, executed_call[0][0] is the first arg (sql string)
-        assert executed_call.args[0].strip() != add_constraint_sql.strip()
-        
-    conn.commit.assert_called_once()
-    # cursor.close is handled by context manager, not called directly on mock
+def test_get_pool_created_once(db_env, mock_db_connection):
+    """Test that the pool is created lazily, once, with the configured credentials."""
+    pool = db_manager.get_pool()
 
-def test_initialize_schema_success_constraint_does_not_exist(mock_db_connection):
-    """Test schema initialization when constraint does not exist."""
-    conn, cursor = mock_db_connection
-    
-    # Simulate the column type check - assume it's already VARCHAR(10)
-    # The first fetchone is for column info, second for constraint check (constraint doesn't exist here)
-    cursor.fetchone.side_effect = [('character varying', 10), None]
-    
-    db_manager.initialize_schema(conn)
-    
-    # Exact SQL strings from app/db_manager.py
-    # Reflects the current implementation with VARCHAR(10)
-    create_table_sql_exact = """
-                CREATE TABLE IF NOT EXISTS currency_rates (
-                    id SERIAL PRIMARY KEY,
-                    date DATE NOT NULL,
-                    currency_code VARCHAR(10) NOT NULL, -- Increased length
-                    rate DECIMAL NOT NULL
-                );
-            """
-
-    check_constraint_sql_exact = """
-                SELECT conname 
-                FROM pg_constraint 
-                WHERE conrelid = 'currency_rates'::regclass 
-                AND conname = 'uq_date_currency_code';
-            """
-    add_constraint_sql_exact = """
-                    ALTER TABLE currency_rates
-                    ADD CONSTRAINT uq_date_currency_code UNIQUE (date, currency_code);
-                """
-
-    # Check calls
-    cursor.execute.assert_any_call(create_table_sql_exact)
-    cursor.execute.assert_any_call(check_constraint_sql_exact)
-    cursor.execute.assert_any_call(add_constraint_sql_exact)
-    
-    conn.commit.assert_called_once()
-    # cursor.close is handled by context manager
+    assert db_manager.get_pool() is pool
+    # minconn connections are opened up front
+    db_manager.psycopg2.connect.assert_called_once_with(
+        host="testhost",
+        port=5432,
+        dbname="testdb",
+        user="testuser",
+        password="testpass"
+    )
+
+def test_borrow_conn_returns_connection_to_pool(mock_db_connection):
+    """Test that a borrowed connection is handed back and reused by the next borrower."""
+    conn_fixture = mock_db_connection
+
+    with db_manager.borrow_conn() as first:
+        assert first is conn_fixture
+    with db_manager.borrow_conn() as second:
+        assert second is conn_fixture
+
+    db_manager.psycopg2.connect.assert_called_once() # No new connection for the second borrow
+    assert conn_fixture.closes == 0
+
+def test_borrow_conn_returns_connection_on_error(mock_db_connection):
+    """Test that the connection is handed back even when the caller raises."""
+    conn_fixture = mock_db_connection
+    conn_fixture.info.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_INERROR
+
+    with pytest.raises(RuntimeError):
+        with db_manager.borrow_conn():
+            raise RuntimeError("Job failed")
+
+    assert conn_fixture.rollbacks == 1 # The pool resets the failed transaction
+    with db_manager.borrow_conn() as conn:
+        assert conn is conn_fixture
+
+@pytest.mark.parametrize("failure", ["closed", "ping_fails"])
+def test_borrow_conn_replaces_stale_connection(mock_db_connection, mocker, failure):
+    """Test that a pooled connection that went stale while idle is discarded and replaced."""
+    stale, fresh = mock_db_connection, FakeConn()
+    mocker.patch('app.db_manager.psycopg2.connect', side_effect=[stale, fresh])
+
+    with db_manager.borrow_conn():
+        pass # Pool created and stale put back as idle
+    if failure == "closed":
+        stale.closed = 1
+    else:
+        stale.cursor_obj.execute_error = psycopg2.OperationalError("server closed the connection unexpectedly")
+
+    with db_manager.borrow_conn() as conn:
+        assert conn is fresh
+
+    assert stale.closes == 1
+    assert db_manager.psycopg2.connect.call_count == 2
+    assert fresh.cursor_obj.executed == [] # A new connection is not pinged
+
+def test_release_db_connection(mock_db_connection):
+    """Test that get_db_connection borrows from the pool and release_db_connection hands it back."""
+    conn_fixture = mock_db_connection
 
-def test_initialize_schema_alter_column_type(mock_db_connection):
-    """Test schema initialization correctly alters column type from VARCHAR(3) to VARCHAR(10)."""
-    conn, cursor = mock_db_connection
+    conn = db_manager.get_db_connection()
+    db_manager.release_db_connection(conn)
 
-    # Simulate column is VARCHAR(3) and constraint does not exist
-    cursor.fetchone.side_effect = [
-        ('character varying', 3), # First fetchone for column info
-        None                     # Second fetchone for constraint check
-    ]
+    assert db_manager.get_db_connection() is conn_fixture # Reused, not reconnected
+    db_manager.psycopg2.connect.assert_called_once()
+    assert conn_fixture.closes == 0
+
+def test_release_db_connection_after_pool_closed(mock_db_connection):
+    """Test that a connection released after close_pool is simply closed."""
+    conn_fixture = mock_db_connection
+
+    conn = db_manager.get_db_connection()
+    db_manager.POOL = None # As if close_pool ran while the connection was out
+    db_manager.release_db_connection(conn)
+
+    assert conn_fixture.closes == 1
+
+def test_close_pool(mock_db_connection):
+    """Test that close_pool closes pooled connections and forgets the pool."""
+    conn_fixture = mock_db_connection
+
+    db_manager.get_pool()
+    db_manager.close_pool()
+
+    assert conn_fixture.closes == 1
+    assert db_manager.POOL is None
+    db_manager.close_pool() # No-op without a pool
+
+def test_initialize_schema_single_round_trip(mock_db_connection):
+    """Test that schema initialization sends one DO block covering every schema step."""
+    conn = mock_db_connection
 
     db_manager.initialize_schema(conn)
 
-    # Exact SQL for altering column
-    alter_column_sql_exact = """
-                        ALTER TABLE currency_rates
-                        ALTER COLUMN currency_code TYPE VARCHAR(10);
-                    """
-    # Exact SQL for adding constraint
-    add_constraint_sql_exact = """
-                    ALTER TABLE currency_rates
-                    ADD CONSTRAINT uq_date_currency_code UNIQUE (date, currency_code);
-                """
-    
-    # Check that ALTER COLUMN is called
-    cursor.execute.assert_any_call(alter_column_sql_exact)
-    # Check that ADD CONSTRAINT is also called (as per mock setup)
-    cursor.execute.assert_any_call(add_constraint_sql_exact)
-    
-    conn.commit.assert_called_once()
+    assert len(conn.cursor_obj.executed) == 1
+    schema_sql, _ = conn.cursor_obj.executed[0]
+    assert schema_sql.strip().startswith("DO $$")
+    for fragment in (_CREATE_TABLE_SQL, _WIDEN_CHECK_SQL, _ALTER_COLUMN_SQL,
+                     _RATE_COLUMN_SQL, _ALTER_RATE_SQL, _ADD_CONSTRAINT_SQL):
+        assert fragment in schema_sql
+    assert conn.cursor_obj.fetches == 0 # Nothing is decided client-side
 
-def test_initialize_schema_db_error_on_create(mock_db_connection):
-    """Test schema initialization with a DB error during CREATE TABLE."""
-    conn, cursor = mock_db_connection
-    cursor.execute.side_effect = [psycopg2.Error("Create table failed"), None, None] # Fail on first execute
+@pytest.mark.parametrize(
+    "already_ready, execute_error, expected_executes, expected_commits, expected_rollbacks, expected_ready",
+    [
+        pytest.param(False, None, 1, 1, 0, True, id="fresh"),
+        pytest.param(True, None, 0, 0, 0, True, id="already_ready"), # Verified earlier in this process
+        pytest.param(False, psycopg2.Error("Schema DO block failed"), 1, 0, 1, False, id="db_error"),
+    ],
+)
+def test_initialize_schema(mock_db_connection, monkeypatch, already_ready, execute_error,
+                           expected_executes, expected_commits, expected_rollbacks, expected_ready):
+    """Test the transaction handling and readiness bookkeeping of schema initialization."""
+    conn = mock_db_connection
+    conn.cursor_obj.execute_error = execute_error
+    monkeypatch.setattr(db_manager, "_SCHEMA_READY", already_ready)
 
-    with pytest.raises(psycopg2.Error, match="Create table failed"):
-      db_manager.initialize_schema(conn)
-    
-    cursor.execute.assert_called_once() # Should fail on the first call (CREATE TABLE)
-    conn.rollback.assert_called_once()
-    # cursor.close is handled by context manager
+    if execute_error is None:
+        db_manager.initialize_schema(conn)
+    else:
+        with pytest.raises(psycopg2.Error, match="Schema DO block failed"):
+            db_manager.initialize_schema(conn)
 
-def test_initialize_schema_db_error_on_add_constraint(mock_db_connection):
-    """Test schema initialization with a DB error during ADD CONSTRAINT."""
-    conn, cursor = mock_db_connection
-    # Simulate constraint does not exist initially
-    # First execute (CREATE TABLE) is fine
-    # Second execute (check constraint) is fine, returns None
-    # Third execute (ADD CONSTRAINT) fails
-    cursor.fetchone.return_value = None 
-    
-    def execute_side_effect(sql, params=None):
-        if "ADD CONSTRAINT" in sql:
-            raise psycopg2.Error("Add constraint failed")
-        return MagicMock() # Default for other calls
+    assert len(conn.cursor_obj.executed) == expected_executes
+    assert conn.commits == expected_commits
+    assert conn.rollbacks == expected_rollbacks
+    assert db_manager._SCHEMA_READY is expected_ready
 
-    cursor.execute.side_effect = execute_side_effect
-    
-    with pytest.raises(psycopg2.Error, match="Add constraint failed"):
+def test_initialize_schema_logs_migrations(mock_db_connection, caplog):
+    """Test that the NOTICEs raised by migration steps in the DO block are logged after the commit."""
+    conn = mock_db_connection
+    conn.notices.append("NOTICE:  left over from earlier work\n")
+    execute = conn.cursor_obj.execute
+
+    def execute_with_notice(sql, params=None):
+        execute(sql, params)
+        conn.notices.append("NOTICE:  Converted currency_rates.rate from NUMERIC to REAL.\n")
+
+    conn.cursor_obj.execute = execute_with_notice
+
+    with caplog.at_level("INFO"):
         db_manager.initialize_schema(conn)
-        
-    conn.rollback.assert_called_once()
-    # cursor.close is handled by context manager
+
+    schema_sql, _ = conn.cursor_obj.executed[0]
+    assert schema_sql.count("RAISE NOTICE") == 3 # One per migration step
+    assert "Schema migration: Converted currency_rates.rate from NUMERIC to REAL." in caplog.text
+    assert "left over" not in caplog.text
+
+def test_initialize_schema_short_circuits_on_second_call(mock_db_connection):
+    """Test that a successful initialization is remembered and later calls skip the DDL."""
+    conn = mock_db_connection
+
+    db_manager.initialize_schema(conn)
+    calls_after_first = len(conn.cursor_obj.executed)
+    db_manager.initialize_schema(conn)
+
+    assert len(conn.cursor_obj.executed) == calls_after_first == 1
+    assert conn.commits == 1
+
+
+@pytest.mark.parametrize("operation", ["rates_exist", "bulk_insert"])
+def test_missing_table_forgets_schema(mock_db_connection, mocker, operation):
+    """Test that a missing currency_rates table clears the ready flag, so the schema is rebuilt."""
+    conn = mock_db_connection
+    error = psycopg2.errors.UndefinedTable('relation "currency_rates" does not exist')
+    db_manager._SCHEMA_READY = True
+
+    with pytest.raises(psycopg2.errors.UndefinedTable):
+        if operation == "rates_exist":
+            conn.cursor_obj.execute_error = error
+            db_manager.rates_exist_for_date(conn, "2024-01-01")
+        else:
+            mocker.patch('app.db_manager.execute_values', side_effect=error)
+            db_manager.insert_currency_rates_bulk(conn, [("2024-01-01", "EUR", 0.9)])
+
+    assert db_manager._SCHEMA_READY is False
 
 
 def test_insert_currency_rate_success(mock_db_connection):
     """Test successful insertion of a currency rate."""
-    conn, cursor = mock_db_connection
-    cursor.rowcount = 1 # Simulate a successful insertion
+    conn = mock_db_connection
+    conn.cursor_obj.rowcount = 1 # Simulate a successful insertion
     
     test_date = "2024-01-01"
     test_code = "EUR"
     test_rate = 0.9123
     
-    db_manager.insert_currency_rate(conn, test_date, test_code, test_rate)
+    inserted = db_manager.insert_currency_rate(conn, test_date, test_code, test_rate)
     
-    # Exact SQL string from app/db_manager.py, including leading newline, indentation, and comment
-    expected_sql_exact = """
-        INSERT INTO currency_rates (date, currency_code, rate)
-        VALUES (%s, %s, %s)
-        ON CONFLICT (date, currency_code) DO NOTHING; 
-        -- ON CONFLICT DO NOTHING handles duplicates gracefully based on the unique constraint
-    """
-    cursor.execute.assert_called_once_with(
-        expected_sql_exact, # Use the exact string
-        (test_date, test_code, test_rate)
-    )
-    conn.commit.assert_called_once()
+    # The row goes through the prepared statement; the first execute is the PREPARE itself
+    executed = conn.cursor_obj.executed
+    assert _PREPARE_SQL in executed[0][0]
+    assert executed[-1] == (_INSERT_SQL, (test_date, test_code, test_rate))
+    assert inserted == 1
+    assert conn.commits == 0 # Committing is left to the caller
     # cursor.close is handled by context manager
 
 def test_insert_currency_rate_skipped_due_to_conflict(mock_db_connection):
     """Test when insertion is skipped due to ON CONFLICT DO NOTHING."""
-    conn, cursor = mock_db_connection
-    cursor.rowcount = 0 # Simulate no rows affected (conflict occurred)
+    conn = mock_db_connection
+    conn.cursor_obj.rowcount = 0 # Simulate no rows affected (conflict occurred)
 
     test_date = "2024-01-02"
     test_code = "GBP"
     test_rate = 0.88
 
-    db_manager.insert_currency_rate(conn, test_date, test_code, test_rate)
-
-    # Exact SQL string from app/db_manager.py
-    expected_sql_exact = """
-        INSERT INTO currency_rates (date, currency_code, rate)
-        VALUES (%s, %s, %s)
-        ON CONFLICT (date, currency_code) DO NOTHING; 
-        -- ON CONFLICT DO NOTHING handles duplicates gracefully based on the unique constraint
-    """
-    cursor.execute.assert_called_once_with(
-        expected_sql_exact, # Use the exact string
-        (test_date, test_code, test_rate)
-    )
-    conn.commit.assert_called_once() # Commit is still called
+    inserted = db_manager.insert_currency_rate(conn, test_date, test_code, test_rate)
+
+    assert conn.cursor_obj.executed[-1] == (_INSERT_SQL, (test_date, test_code, test_rate))
+    assert inserted == 0
+    assert conn.commits == 0 # Committing is left to the caller
 
 def test_insert_currency_rate_db_error(mock_db_connection):
     """Test currency rate insertion with a database error."""
-    conn, cursor = mock_db_connection
-    cursor.execute.side_effect = psycopg2.Error("Insert failed")
+    conn = mock_db_connection
+    conn.cursor_obj.execute_error = psycopg2.Error("Insert failed")
     
     with pytest.raises(psycopg2.Error, match="Insert failed"): # Match the specific error
         db_manager.insert_currency_rate(conn, "2024-01-01", "USD", 1.0)
         
-    conn.rollback.assert_called_once()
+    assert conn.rollbacks == 0 # The caller owns the transaction
+    assert conn.commits == 0
     # cursor.close is handled by context manager
+
+def test_prepare_statements_once_per_connection(mock_db_connection):
+    """Test that ins_rate is prepared on the first insert only, per connection."""
+    conn = mock_db_connection
+    conn.cursor_obj.rowcount = 1
+
+    db_manager.insert_currency_rate(conn, "2024-01-01", "EUR", 0.9)
+    db_manager.insert_currency_rate(conn, "2024-01-01", "GBP", 0.8)
+
+    executed_sql = [sql for sql, _ in conn.cursor_obj.executed]
+    assert sum(_PREPARE_SQL in sql for sql in executed_sql) == 1
+    assert executed_sql.count(_INSERT_SQL) == 2
+
+    other_conn = FakeConn()
+    db_manager.prepare_statements(other_conn)
+    assert len(other_conn.cursor_obj.executed) == 1 # A new connection gets its own PREPARE
+
+def test_rates_exist_for_date(mock_db_connection):
+    """Test the single-row lookup used to skip dates that are already stored."""
+    conn = mock_db_connection
+    conn.cursor_obj.fetchone_results = [(1,), None]
+
+    assert db_manager.rates_exist_for_date(conn, "2024-01-01") is True
+    assert db_manager.rates_exist_for_date(conn, "2024-01-02") is False
+
+    assert conn.cursor_obj.executed[-1] == (_RATES_EXIST_SQL, ("2024-01-02",))
+
+def test_insert_currency_rates_bulk_success(mock_db_connection, mocker):
+    """Test that all rows are inserted with a single execute_values call and one commit."""
+    conn = mock_db_connection
+    cursor = conn.cursor_obj
+    cursor.rowcount = 2 # Simulate both rows inserted
+    mock_execute_values = mocker.patch('app.db_manager.execute_values')
+    rows = [("2024-01-01", "EUR", 0.9), ("2024-01-01", "GBP", 0.8)]
+
+    inserted = db_manager.insert_currency_rates_bulk(conn, rows)
+
+    mock_execute_values.assert_called_once()
+    args, kwargs = mock_execute_values.call_args
+    assert args[0] is cursor
+    assert "ON CONFLICT (date, currency_code) DO NOTHING" in args[1]
+    assert args[2] == rows
+    assert kwargs["page_size"] == len(rows)
+    assert inserted == 2
+    assert conn.commits == 1
+
+def test_insert_currency_rates_bulk_no_rows(mock_db_connection, mocker):
+    """Test that nothing is sent to the database for an empty batch."""
+    conn = mock_db_connection
+    mock_execute_values = mocker.patch('app.db_manager.execute_values')
+
+    inserted = db_manager.insert_currency_rates_bulk(conn, [])
+
+    assert inserted == 0
+    mock_execute_values.assert_not_called()
+    assert conn.commits == 0
+
+def test_insert_currency_rates_bulk_db_error(mock_db_connection, mocker):
+    """Test bulk insertion with a database error."""
+    conn = mock_db_connection
+    mocker.patch('app.db_manager.execute_values', side_effect=psycopg2.Error("Bulk insert failed"))
+
+    with pytest.raises(psycopg2.Error, match="Bulk insert failed"):
+        db_manager.insert_currency_rates_bulk(conn, [("2024-01-01", "EUR", 0.9)])
+
+    assert conn.rollbacks == 1
+    assert conn.commits == 0
+
+def test_copy_currency_rates_success(mock_db_connection):
+    """Test that rows are streamed with COPY into the staging table and merged."""
+    conn = mock_db_connection
+    cursor = conn.cursor_obj
+    cursor.fetchone_results = [(1, 1)] # One new row, one already stored
+
+    inserted = db_manager.copy_currency_rates(conn, [("2024-01-01", "EUR", 0.9), ("2024-01-01", "GBP", 0.8)])
+
+    assert inserted == 1
+    assert len(cursor.copied) == 1
+    copy_sql, data = cursor.copied[0]
+    assert copy_sql.startswith("COPY stg_rates")
+    assert data == "2024-01-01\tEUR\t0.9\n2024-01-01\tGBP\t0.8\n"
+    executed_sql = [sql for sql, _ in cursor.executed]
+    assert "CREATE TEMP TABLE IF NOT EXISTS stg_rates" in executed_sql[0]
+    assert "ON CONFLICT (date, currency_code) DO NOTHING" in executed_sql[1]
+    assert "RETURNING 1" in executed_sql[1] # Counts come from the same statement
+    assert len(executed_sql) == 2
+    assert conn.commits == 1
+
+def test_copy_currency_rates_escapes_codes(mock_db_connection):
+    """Test that tabs, newlines and backslashes in a code are escaped for COPY's text format."""
+    conn = mock_db_connection
+    conn.cursor_obj.fetchone_results = [(1, 0)]
+
+    db_manager.copy_currency_rates(conn, [("2024-01-01", "A\tB\\C\nD\r", 0.5)])
+
+    _, data = conn.cursor_obj.copied[0]
+    assert data == "2024-01-01\tA\\tB\\\\C\\nD\\r\t0.5\n" # Still one line of three columns
+
+def test_copy_currency_rates_db_error(mock_db_connection):
+    """Test COPY path with a database error."""
+    conn = mock_db_connection
+    conn.cursor_obj.copy_error = psycopg2.Error("Copy failed")
+
+    with pytest.raises(psycopg2.Error, match="Copy failed"):
+        db_manager.copy_currency_rates(conn, [("2024-01-01", "EUR", 0.9)])
+
+    assert conn.rollbacks == 1
+    assert conn.commits == 0
+
+def test_bulk_upsert_rates_small_batch_uses_insert(mock_db_connection, mocker):
+    """Test that batches below COPY_THRESHOLD use the multi-row INSERT."""
+    conn = mock_db_connection
+    mock_insert = mocker.patch('app.db_manager.insert_currency_rates_bulk', return_value=1)
+    mock_copy = mocker.patch('app.db_manager.copy_currency_rates')
+    rows = [("2024-01-01", "EUR", 0.9)]
+
+    db_manager.bulk_upsert_rates(conn, rows)
+
+    mock_insert.assert_called_once_with(conn, rows)
+    mock_copy.assert_not_called()
+
+def test_bulk_upsert_rates_large_batch_uses_copy(mock_db_connection, mocker):
+    """Test that batches of COPY_THRESHOLD rows or more use COPY."""
+    conn = mock_db_connection
+    rows = [("2024-01-01", f"C{i:04d}", 1.0) for i in range(db_manager.COPY_THRESHOLD)]
+    mock_insert = mocker.patch('app.db_manager.insert_currency_rates_bulk')
+    mock_copy = mocker.patch('app.db_manager.copy_currency_rates', return_value=len(rows))
+
+    db_manager.bulk_upsert_rates(conn, rows)
+
+    mock_copy.assert_called_once_with(conn, rows)
+    mock_insert.assert_not_called()
@@ -1,31 +1,42 @@
 import pytest
 from unittest.mock import patch, MagicMock, call
+from dataclasses import replace
 from datetime import datetime, timezone
+import psycopg2 # For exception types
 
 # Adjust the import path according to your project structure
 from app import main
 from app import db_manager # To mock its functions
 from app import currency_fetcher # To mock its functions
 
-# Mock environment variables for db_manager and currency_fetcher if they are accessed globally
-# For main.py, SCRIPT_MODE is key.
+_real_initialize_schema = db_manager.initialize_schema # Before the fixtures replace it
+
+# Settings are read once into app.config.CFG at import, so tests swap in their own Config.
+# For main.py, SCRIPT_MODE is still read from the environment at startup.
 @pytest.fixture(autouse=True)
-def mock_env_vars(monkeypatch):
-    """Mock environment variables needed by sub-modules if not already mocked by specific tests."""
-    monkeypatch.setenv("CURRENCY_API_KEY", "fake_api_key_for_main_tests")
-    monkeypatch.setenv("DB_HOST", "main_testhost")
-    monkeypatch.setenv("DB_PORT", "main_5432")
-    monkeypatch.setenv("DB_NAME", "main_testdb")
-    monkeypatch.setenv("DB_USER", "main_testuser")
-    monkeypatch.setenv("DB_PASSWORD", "main_testpass")
+def mock_config(monkeypatch):
+    """Mock the configuration main.py reads its API key from."""
+    test_config = replace(
+        main.CFG,
+        api_key="fake_api_key_for_main_tests",
+        db_host="main_testhost",
+        db_name="main_testdb",
+        db_user="main_testuser",
+        db_password="main_testpass"
+    )
+    monkeypatch.setattr(main, "CFG", test_config)
+    return test_config
 
 @pytest.fixture
 def mock_db_connection_main(mocker):
-    """Fixture to mock db_manager's get_db_connection and initialize_schema for main.py tests."""
+    """Fixture to mock db_manager's connection pool and initialize_schema for main.py tests."""
     mock_conn = MagicMock()
-    mocker.patch('app.db_manager.get_db_connection', return_value=mock_conn)
+    mock_borrow = mocker.patch('app.db_manager.borrow_conn')
+    mock_borrow.return_value.__enter__.return_value = mock_conn # borrow_conn() yields mock_conn
+    mocker.patch('app.db_manager.close_pool')
     mocker.patch('app.db_manager.initialize_schema') # Assume success
-    mocker.patch('app.db_manager.insert_currency_rate') # Assume success
+    mocker.patch('app.db_manager.rates_exist_for_date', return_value=False) # Nothing stored yet
+    mocker.patch('app.db_manager.bulk_upsert_rates') # Assume success
     return mock_conn
 
 @pytest.fixture
@@ -55,35 +66,31 @@ def test_fetch_and_store_rates_job_success(mock_db_connection_main, mock_currenc
     # Verify fetcher was called
     mock_currency_fetcher_main.assert_called_once()
     
-    # Verify DB connection and schema initialization
-    db_manager.get_db_connection.assert_called_once()
+    # Verify DB connection; the job's schema check is a no-op once startup set the schema up
+    db_manager.borrow_conn.assert_called_once()
     db_manager.initialize_schema.assert_called_once_with(mock_conn)
     
-    # Verify insert_currency_rate calls
+    # Verify all rates are handed to the bulk insert in a single call
     expected_date_obj = datetime.fromtimestamp(mock_api_response["updated"], timezone.utc).date()
-    calls = [
-        call(mock_conn, expected_date_obj, "EUR", 0.9), # Direct rate value
-        call(mock_conn, expected_date_obj, "GBP", 0.8)  # Direct rate value
-    ]
-    db_manager.insert_currency_rate.assert_has_calls(calls, any_order=True)
-    assert db_manager.insert_currency_rate.call_count == 2
+    db_manager.bulk_upsert_rates.assert_called_once_with(
+        mock_conn, [(expected_date_obj, "EUR", 0.9), (expected_date_obj, "GBP", 0.8)]
+    )
     
-    mock_conn.close.assert_called_once()
+    mock_conn.close.assert_not_called() # Handed back to the pool, not closed
+    db_manager.borrow_conn.return_value.__exit__.assert_called_once()
 
 def test_fetch_and_store_rates_job_fetch_returns_none(mock_db_connection_main, mock_currency_fetcher_main):
     """Test job when currency_fetcher returns an error dictionary."""
-    mock_conn = mock_db_connection_main # This mock_conn won't be used if job exits early
+    mock_conn = mock_db_connection_main
     # Mock returns an error dictionary
     mock_currency_fetcher_main.return_value = {"error": "API communication failed"}
     
     main.fetch_and_store_rates_job()
     
     mock_currency_fetcher_main.assert_called_once()
-    # If fetch fails and job returns, these should not be called
-    db_manager.get_db_connection.assert_not_called()
-    db_manager.initialize_schema.assert_not_called()
-    db_manager.insert_currency_rate.assert_not_called()
-    mock_conn.close.assert_not_called() # db_conn would be None in job
+    # Nothing to store, so no connection is borrowed
+    db_manager.borrow_conn.assert_not_called()
+    db_manager.bulk_upsert_rates.assert_not_called()
 
 
 def test_fetch_and_store_rates_job_no_updated_timestamp_from_api(mock_db_connection_main, mock_currency_fetcher_main, mocker):
@@ -97,26 +104,17 @@ def test_fetch_and_store_rates_job_no_updated_timestamp_from_api(mock_db_connect
     }
     mock_currency_fetcher_main.return_value = mock_api_response
 
-    # Mock datetime.now(timezone.utc) to control current date
+    # Pin the clock main.py falls back to
     fixed_now_utc = datetime(2024, 1, 16, 12, 0, 0, tzinfo=timezone.utc)
-    # We need to mock datetime object within app.main specifically
-    # and ensure its 'now' method returns our fixed_now_utc when called with timezone.utc
-    mock_datetime = MagicMock()
-    mock_datetime.now.return_value = fixed_now_utc
-    mock_datetime.fromtimestamp = datetime.fromtimestamp # Keep original fromtimestamp
-    mock_datetime.UTC = timezone.utc # Ensure UTC is available if needed by other parts of the mocked datetime
-    
-    mocker.patch('app.main.datetime', mock_datetime)
-    mocker.patch('app.main.timezone', timezone) # Ensure the original timezone object is used
+    mocker.patch('app.main._utcnow', return_value=fixed_now_utc)
 
     main.fetch_and_store_rates_job()
 
-    expected_date_obj = fixed_now_utc.date() # From mocked datetime.now(timezone.utc)
-    # Check that insert_currency_rate was called with the rate from the "rates" dictionary
-    db_manager.insert_currency_rate.assert_called_once_with(
-        mock_conn, expected_date_obj, "USD", 1.0 # Direct rate value
+    expected_date_obj = fixed_now_utc.date() # From the pinned _utcnow()
+    # Check that the bulk insert was called with the rates from the "rates" dictionary
+    db_manager.bulk_upsert_rates.assert_called_once_with(
+        mock_conn, [(expected_date_obj, "USD", 1.0)]
     )
-    mock_conn.close.assert_called_once()
 
 def test_fetch_and_store_rates_job_db_connection_fails(mock_currency_fetcher_main, mocker):
     """Test job when getting a DB connection fails."""
@@ -128,66 +126,220 @@ def test_fetch_and_store_rates_job_db_connection_fails(mock_currency_fetcher_mai
         "rates": {"USD": 1.0}
     }
     
-    mocker.patch('app.db_manager.get_db_connection', return_value=None) # DB connection fails
+    mock_borrow = mocker.patch('app.db_manager.borrow_conn')
+    mock_borrow.return_value.__enter__.side_effect = psycopg2.OperationalError("Connection failed") # DB connection fails
     mock_initialize_schema = mocker.patch('app.db_manager.initialize_schema')
-    mock_insert_rate = mocker.patch('app.db_manager.insert_currency_rate')
+    mock_insert_rate = mocker.patch('app.db_manager.bulk_upsert_rates')
     
-    main.fetch_and_store_rates_job()
+    main.fetch_and_store_rates_job() # Error is logged, not raised
     
     mock_currency_fetcher_main.assert_called_once() 
-    db_manager.get_db_connection.assert_called_once()
+    mock_borrow.assert_called_once()
     mock_initialize_schema.assert_not_called()
     mock_insert_rate.assert_not_called()
 
-@patch('app.main.BlockingScheduler')
-@patch.dict('os.environ', {'SCRIPT_MODE': 'run_once'})
-def test_main_run_once_mode(mock_scheduler_constructor): # Removed unused db/fetcher mocks
-    """Test SCRIPT_MODE='run_once' executes job directly, no schedule."""
-    mock_scheduler_instance = mock_scheduler_constructor.return_value
-    
-    with patch('app.main.fetch_and_store_rates_job') as mock_job:
-        main.run_application_logic() # Call the new refactored function
-        mock_job.assert_called_once()
-        
-    mock_scheduler_instance.add_job.assert_not_called()
-    mock_scheduler_instance.start.assert_not_called()
-
-@patch('app.main.BlockingScheduler')
-@patch('app.main.fetch_and_store_rates_job') # Patch at method level
-@patch.dict('os.environ', {'SCRIPT_MODE': 'schedule'}) 
-def test_main_schedule_mode(mock_fetch_job_patch, mock_scheduler_constructor): # Renamed mock_fetch_job
-    """Test SCRIPT_MODE='schedule' schedules job and starts scheduler."""
-    mock_scheduler_instance = mock_scheduler_constructor.return_value
-    
-    main.run_application_logic() # Call the new refactored function
-    
-    mock_fetch_job_patch.assert_not_called() # The job itself is not called directly by run_application_logic
-
-    mock_scheduler_instance.add_job.assert_called_once_with(
-        mock_fetch_job_patch, # Assert add_job was called with the mock object
-        'cron',
-        hour=6,
-        minute=0
-        # timezone="UTC" is set in BlockingScheduler constructor in app.main
-    )
-    mock_scheduler_instance.start.assert_called_once()
-
-@patch('app.main.BlockingScheduler')
-@patch('app.main.fetch_and_store_rates_job') # Patch at method level
-@patch.dict('os.environ', {}, clear=True) 
-def test_main_default_schedule_mode(mock_fetch_job_patch, mock_scheduler_constructor): # Renamed mock_fetch_job
-    """Test default SCRIPT_MODE (not set) schedules job and starts scheduler."""
-    mock_scheduler_instance = mock_scheduler_constructor.return_value
-    
-    main.run_application_logic() # Call the new refactored function
+@pytest.mark.parametrize("script_mode, expect_direct_call, expect_schedule", [
+    ("run_once", True, False),
+    ("schedule", False, True),
+    (None, False, True), # SCRIPT_MODE not set defaults to schedule
+])
+def test_main_mode(script_mode, expect_direct_call, expect_schedule, monkeypatch, mocker, mock_db_connection_main):
+    """Test that SCRIPT_MODE either runs the job directly or schedules it and starts the scheduler."""
+    monkeypatch.delenv("SCRIPT_MODE", raising=False)
+    if script_mode is not None:
+        monkeypatch.setenv("SCRIPT_MODE", script_mode)
+    mock_scheduler_instance = mocker.patch('app.main.BackgroundScheduler').return_value
+    mock_pause = mocker.patch('app.main.signal.pause')
+    mock_job = mocker.patch('app.main.fetch_and_store_rates_job')
+
+    main.run_application_logic()
+
+    assert mock_job.called is expect_direct_call # The scheduler, not run_application_logic, runs scheduled jobs
+    if expect_schedule:
+        mock_scheduler_instance.add_job.assert_called_once_with(
+            mock_job, # Assert add_job was called with the mock object
+            'cron',
+            hour=6,
+            minute=0
+            # timezone="UTC" is set in BackgroundScheduler constructor in app.main
+        )
+        mock_scheduler_instance.start.assert_called_once()
+        mock_pause.assert_called_once()
+        mock_scheduler_instance.shutdown.assert_called_once()
+    else:
+        mock_scheduler_instance.add_job.assert_not_called()
+        mock_scheduler_instance.start.assert_not_called()
+        mock_pause.assert_not_called()
+    db_manager.initialize_schema.assert_called_once_with(mock_db_connection_main) # Once, before the first run
+    db_manager.close_pool.assert_called_once()
+
+
+def test_run_application_logic_missing_settings(mock_config, mock_db_connection_main, monkeypatch):
+    """Test that startup exits non-zero before any database work when a required setting is missing."""
+    monkeypatch.setattr(main, "CFG", replace(mock_config, db_host=None))
+
+    with pytest.raises(SystemExit) as exc_info:
+        main.run_application_logic()
+
+    assert exc_info.value.code == 1
+    db_manager.borrow_conn.assert_not_called()
+
+
+def test_run_application_logic_schema_init_fails(mock_db_connection_main, mock_currency_fetcher_main):
+    """Test that a failed schema initialization at startup is logged and the job still runs."""
+    mock_currency_fetcher_main.return_value = {"error": "API communication failed"}
+    db_manager.initialize_schema.side_effect = Exception("Schema init failed")
+
+    with patch.dict('os.environ', {'SCRIPT_MODE': 'run_once'}):
+        main.run_application_logic() # Error is logged, not raised
+
+    mock_currency_fetcher_main.assert_called_once()
+    db_manager.borrow_conn.return_value.__exit__.assert_called_once() # Still handed back
+    db_manager.close_pool.assert_called_once()
+
+
+def test_run_application_logic_initializes_schema_once(mock_db_connection_main, mock_currency_fetcher_main, mocker, monkeypatch):
+    """Test that the schema DDL runs once per process, however often the job runs."""
+    monkeypatch.setattr(db_manager, "_SCHEMA_READY", False)
+    db_manager.initialize_schema.side_effect = _real_initialize_schema
+    mock_currency_fetcher_main.return_value = {
+        "valid": True,
+        "updated": 1609459200,
+        "base": "USD",
+        "rates": {"USD": 1.0}
+    }
+    mock_scheduler_instance = mocker.patch('app.main.BackgroundScheduler').return_value
+
+    def run_two_ticks():
+        job = mock_scheduler_instance.add_job.call_args.args[0]
+        job()
+        job()
+
+    mocker.patch('app.main.signal.pause', side_effect=run_two_ticks)
+
+    with patch.dict('os.environ', {'SCRIPT_MODE': 'schedule'}):
+        main.run_application_logic()
+
+    assert db_manager.bulk_upsert_rates.call_count == 2
+    # Startup and both runs call initialize_schema, but only the first one sends the DO block
+    assert db_manager.initialize_schema.call_count == 3
+    schema_cursor = mock_db_connection_main.cursor.return_value.__enter__.return_value
+    schema_cursor.execute.assert_called_once()
+    assert db_manager._SCHEMA_READY is True
+
+
+def test_fetch_and_store_rates_job_no_api_key(mock_config, mock_db_connection_main, mock_currency_fetcher_main, monkeypatch):
+    """Test job exits before any I/O when no API key is configured."""
+    monkeypatch.setattr(main, "CFG", replace(mock_config, api_key=None))
+
+    main.fetch_and_store_rates_job()
+
+    mock_currency_fetcher_main.assert_not_called()
+    db_manager.borrow_conn.assert_not_called()
+
+
+def test_fetch_and_store_rates_job_skips_invalid_rates(mock_db_connection_main, mock_currency_fetcher_main):
+    """Test that rates which cannot be converted to float are dropped before the insert."""
+    mock_conn = mock_db_connection_main
+    mock_currency_fetcher_main.return_value = {
+        "valid": True,
+        "updated": 1609459200,
+        "base": "USD",
+        "rates": {"EUR": "0.9", "BAD": "n/a", "NUL": None}
+    }
+
+    main.fetch_and_store_rates_job()
 
-    mock_fetch_job_patch.assert_not_called() # The job itself is not called directly
+    expected_date_obj = datetime.fromtimestamp(1609459200, timezone.utc).date()
+    db_manager.bulk_upsert_rates.assert_called_once_with(mock_conn, [(expected_date_obj, "EUR", 0.9)])
 
-    mock_scheduler_instance.add_job.assert_called_once_with(
-        mock_fetch_job_patch, # Assert add_job was called with the mock object
-        'cron',
-        hour=6,
-        minute=0
-        # timezone="UTC" is set in BlockingScheduler constructor in app.main
+def test_fetch_and_store_rates_job_skips_rates_the_database_rejects(mock_db_connection_main, mock_currency_fetcher_main):
+    """Test that over-long codes and non-finite or out-of-range rates are dropped so they cannot fail the batch."""
+    mock_conn = mock_db_connection_main
+    mock_currency_fetcher_main.return_value = {
+        "valid": True,
+        "updated": 1609459200,
+        "base": "USD",
+        "rates": {
+            "EUR": 0.9,
+            "TOOLONGCODE": 1.0, # 11 characters, column is VARCHAR(10)
+            "HUGE": 1e39, # Beyond REAL
+            "INF": "inf",
+            "NAN": "nan",
+            "BTCTOKEN10": 0.00002, # Exactly 10 characters is fine
+        }
+    }
+
+    main.fetch_and_store_rates_job()
+
+    expected_date_obj = datetime.fromtimestamp(1609459200, timezone.utc).date()
+    db_manager.bulk_upsert_rates.assert_called_once_with(
+        mock_conn, [(expected_date_obj, "EUR", 0.9), (expected_date_obj, "BTCTOKEN10", 0.00002)]
     )
-    mock_scheduler_instance.start.assert_called_once()
+
+def test_fetch_and_store_rates_job_no_valid_rates(mock_db_connection_main, mock_currency_fetcher_main):
+    """Test that no insert is attempted when none of the rates is valid."""
+    mock_currency_fetcher_main.return_value = {
+        "valid": True,
+        "updated": 1609459200,
+        "base": "USD",
+        "rates": {"BAD": "n/a"}
+    }
+
+    main.fetch_and_store_rates_job()
+
+    db_manager.borrow_conn.assert_not_called()
+    db_manager.bulk_upsert_rates.assert_not_called()
+
+def test_fetch_and_store_rates_job_recreates_missing_table(mock_db_connection_main, mock_currency_fetcher_main):
+    """Test that a table dropped since startup is recreated and the rates stored in the same run."""
+    mock_conn = mock_db_connection_main
+    mock_currency_fetcher_main.return_value = {
+        "valid": True,
+        "updated": 1609459200,
+        "base": "USD",
+        "rates": {"USD": 1.0}
+    }
+    db_manager.rates_exist_for_date.side_effect = [
+        psycopg2.errors.UndefinedTable('relation "currency_rates" does not exist'),
+        False,
+    ]
+
+    main.fetch_and_store_rates_job()
+
+    mock_conn.rollback.assert_called_once()
+    assert db_manager.initialize_schema.call_args_list == [call(mock_conn), call(mock_conn)] # Routine check, then the rebuild
+    expected_date_obj = datetime.fromtimestamp(1609459200, timezone.utc).date()
+    db_manager.bulk_upsert_rates.assert_called_once_with(mock_conn, [(expected_date_obj, "USD", 1.0)])
+
+def test_fetch_and_store_rates_job_empty_rates(mock_db_connection_main, mock_currency_fetcher_main):
+    """Test that an empty rates mapping ends the job before a connection is borrowed."""
+    mock_currency_fetcher_main.return_value = {
+        "valid": True,
+        "updated": 1609459200,
+        "base": "USD",
+        "rates": {}
+    }
+
+    main.fetch_and_store_rates_job()
+
+    db_manager.borrow_conn.assert_not_called()
+    db_manager.bulk_upsert_rates.assert_not_called()
+
+
+def test_fetch_and_store_rates_job_date_already_stored(mock_db_connection_main, mock_currency_fetcher_main):
+    """Test that a rerun for a date that is already stored skips the insert."""
+    mock_conn = mock_db_connection_main
+    mock_currency_fetcher_main.return_value = {
+        "valid": True,
+        "updated": 1609459200,
+        "base": "USD",
+        "rates": {"USD": 1.0}
+    }
+    db_manager.rates_exist_for_date.return_value = True
+
+    main.fetch_and_store_rates_job()
+
+    expected_date_obj = datetime.fromtimestamp(1609459200, timezone.utc).date()
+    db_manager.rates_exist_for_date.assert_called_once_with(mock_conn, expected_date_obj)
+    db_manager.bulk_upsert_rates.assert_not_called()